@@ -0,0 +1,77 @@
+'''
+Title:          tracing_benchmark
+Description:    Measures the per-packet cost of tracing a forwarded packet
+                Compares no logging, the old eager log_debug("...".format(str(pkt)))
+                with debug off, a disabled Tracer (called directly and behind an
+                "if trace.on" guard), and a Tracer enabled at 1 in N (logging to a
+                handler that discards records). Reports ns per packet and the
+                overhead over no logging.
+Usage:          python3 tracing_benchmark.py [--packets 200000] [--every 100]
+'''
+import time
+import logging
+import argparse
+
+from switchyard.lib.userlib import *
+
+import tracing
+
+def make_packet():
+    return (Ethernet(src="30:00:00:00:00:01", dst="10:00:00:00:00:01", ethertype=EtherType.IPv4) +
+            IPv4(src="192.168.1.2", dst="172.16.42.2", protocol=IPProtocol.ICMP, ttl=64) +
+            ICMP())
+
+def run(body, packets):
+    start = time.perf_counter()
+    body(packets)
+    return (time.perf_counter() - start) / packets * 1e9
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark per-packet tracing cost")
+    parser.add_argument("--packets", type=int, default=200000)
+    parser.add_argument("--every",   type=int, default=100)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)             #Like swyard without -v
+    pkt   = make_packet()
+    trace = tracing.get_tracer("benchmark")
+
+    def no_logging(n):
+        for _ in range(n):
+            pass
+
+    def eager(n):
+        for _ in range(n):
+            log_debug("Got a packet: {}".format(str(pkt)))
+
+    def traced(n):
+        for _ in range(n):
+            trace.next_packet()
+            trace.trace("Got a packet: {}", pkt)
+
+    def guarded(n):
+        for _ in range(n):
+            if trace.enabled: trace.next_packet()
+            if trace.on: trace.trace("Got a packet: {}", pkt)
+
+    cases = [("no logging", no_logging), ("eager log_debug", eager)]
+    results = [(name, run(body, args.packets)) for name, body in cases]
+
+    tracing.configure("benchmark", None, 1)
+    results.append(("tracer disabled", run(traced, args.packets)))
+    results.append(("guarded disabled", run(guarded, args.packets)))
+
+    #Enabled, with records discarded so only formatting and logging are timed
+    trace.logger.addHandler(logging.NullHandler())
+    trace.logger.propagate = False
+    tracing.configure("benchmark", "DEBUG", args.every)
+    results.append(("tracer 1 in {}".format(args.every), run(traced, args.packets)))
+
+    base = results[0][1]
+    print("{:>18} {:>10} {:>10}".format("case", "ns/pkt", "overhead"))
+    print("-" * 40)
+    for name, ns in results:
+        print("{:>18} {:>10.1f} {:>10.1f}".format(name, ns, ns - base))
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,10 @@
 import sys
 from switchyard.lib.userlib import *
 
+import tracing
+
+TRACE = tracing.get_tracer("switch_fifo")
+
 def isBroadcast(addr):
     return SpecialEthAddr.ETHER_BROADCAST.value == addr
 
@@ -63,7 +67,7 @@ def safe_send_packet(net, intf_name, pkt):
 def broadcast(net, egresses, skip, pkt):
     for intf in egresses:
         if intf.name != skip:
-            log_debug("Flooding packet {} to {}".format(packet, intf.name))
+            TRACE.trace("Flooding packet {} to {}", pkt, intf.name)
             safe_send_packet(net, intf.name, pkt)
 
 
@@ -71,6 +75,7 @@ def main(net):
     my_interfaces = net.interfaces()
     mymacs = [intf.ethaddr for intf in my_interfaces]
     forwarding_table = ForwardingTable()
+    TRACE.refresh()
 
     while True:
         try:
@@ -84,8 +89,9 @@ def main(net):
 
         forwarding_table.update(packet[0].src, input_port)
 
-        log_debug("In {} received packet {} on {}".format(
-            net.name, packet, input_port))
+        TRACE.next_packet()
+        TRACE.trace("In {} received packet {} on {}",
+                    net.name, packet, input_port)
 
         # drop packet intended for me
         if packet[0].dst in mymacs:
@@ -5,6 +5,10 @@ from datetime import datetime
 import SpanningTreeMessage as STM
 from switchyard.lib.userlib import *
 
+import tracing
+
+TRACE = tracing.get_tracer("switch_stp")
+
 
 def isBroadcast(addr):
     return SpecialEthAddr.ETHER_BROADCAST.value == addr
@@ -119,8 +123,8 @@ def emit_stm(net, interfaces, stp_context):
                                dst="ff:ff:ff:ff:ff:ff",
                                ethertype=EtherType.SLOW) + spm
                 safe_send_packet(net, intf.name, pkt)
-                log_debug("{} emitted STM on {}: {}".format(
-                    stp_context.my_id, intf.name, pkt))
+                TRACE.debug("{} emitted STM on {}: {}",
+                            stp_context.my_id, intf.name, pkt)
 
             stp_context.time_last_spm_tx = datetime.now()
 
@@ -133,12 +137,12 @@ def emit_stm(net, interfaces, stp_context):
 
 def handle_stm(net, interfaces, stp_context, pkt, incoming_interface):
     stp_context.time_last_spm_rx = datetime.now()
-    log_debug("{} received STM on {}: {}".format(stp_context.my_id,
-                                                 incoming_interface, pkt))
+    TRACE.trace("{} received STM on {}: {}", stp_context.my_id,
+                incoming_interface, pkt)
     stm = STM.SpanningTreeMessage()
     b = pkt[1].to_bytes()
     stm.from_bytes(b)
-    log_debug("STM: {}".format(stm))
+    TRACE.trace("STM: {}", stm)
     stm.hops_to_root += 1
 
     def update_info_as_described_in_point_4_and_forward_STP():
@@ -213,7 +217,7 @@ def safe_send_packet(net, intf_name, pkt):
 def broadcast(net, egresses, skip, pkt):
     for intf in egresses:
         if intf.name not in skip:
-            log_debug("Flooding packet {} to {}".format(packet, intf.name))
+            TRACE.trace("Flooding packet {} to {}", pkt, intf.name)
             safe_send_packet(net, intf.name, pkt)
 
 
@@ -222,14 +226,22 @@ def main(net):
     my_interfaces = net.interfaces()
     mymacs = [intf.ethaddr for intf in my_interfaces]
     forwarding_table = ForwardingTable()
+    TRACE.refresh()
 
     mymacs.sort()
     stp_context = SpanningTreeContext(mymacs[0])
 
+    # handlers for control traffic, keyed by the ethertype of the first header;
+    # every other packet is switched
+    handlers = {
+        EtherType.SLOW: lambda packet, input_port: handle_stm(
+            net, my_interfaces, stp_context, packet, input_port),
+    }
+
     while True:
         emit_stm(net, my_interfaces, stp_context)
 
-        log_debug(stp_context)
+        TRACE.debug("{}", stp_context)
 
         try:
             _, input_port, packet = net.recv_packet(timeout=1)
@@ -240,12 +252,14 @@ def main(net):
             log_debug("Received signal for shutdown!")
             return
 
-        log_debug("In {} received packet {} on {}".format(
-            net.name, packet, input_port))
+        TRACE.next_packet()
+        TRACE.trace("In {} received packet {} on {}",
+                    net.name, packet, input_port)
 
-        # code path to soley handling STM packets
-        if packet[0].ethertype == EtherType.SLOW:
-            handle_stm(net, my_interfaces, stp_context, packet, input_port)
+        # code path to soley handling control packets (STM)
+        handler = handlers.get(packet[0].ethertype)
+        if handler is not None:
+            handler(packet, input_port)
             continue
 
         forwarding_table.update(packet[0].src, input_port)
@@ -2,5 +2,5 @@
 
 target="/tmp/.tar.gz"
 
-tar -czvf "${target}" \
-    myswitch_fifo.py myswitch_stp.py SpanningTreeMessage.py README
+tar -czhvf "${target}" \
+    myswitch_fifo.py myswitch_stp.py SpanningTreeMessage.py tracing.py README
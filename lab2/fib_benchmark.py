@@ -0,0 +1,225 @@
+'''
+Title:          fib_benchmark
+Description:    Benchmarks the myrouter_part3 ForwardingTable backends on synthetic tables
+                Generates tables with an Internet-like prefix length distribution and
+                random or skewed destination streams, then times route insertion, text
+                and compiled file loading and lookups for each backend. Reports
+                lookups/s, p50/p99 lookup latency and peak RSS. Batch lookups are
+                timed as a whole, so their p50/p99 are reported as n/a.
+                Each (size, backend) case runs in its own process so peak RSS is per case.
+Usage:          python3 fib_benchmark.py [--sizes 1000,10000,100000,1000000]
+                                         [--backends trie,dir24,batch]
+                                         [--lookups 200000] [--stream uniform|zipf]
+'''
+import sys
+import os
+import time
+import json
+import random
+import argparse
+import resource
+import tempfile
+import subprocess
+
+from ipaddress import IPv4Address
+
+#Approximate share of each prefix length in a full Internet table
+PREFIX_LENGTHS = {
+     8: 0.001, 12: 0.002, 13: 0.003, 14: 0.005, 15: 0.007, 16: 0.015, 17: 0.010,
+    18: 0.020, 19: 0.040, 20: 0.060, 21: 0.060, 22: 0.120, 23: 0.100, 24: 0.557,
+}
+
+INTERFACES = [
+    ("router-eth0", "10:00:00:00:00:01", "192.168.1.1", "255.255.255.252"),
+    ("router-eth1", "10:00:00:00:00:02", "10.10.0.1",   "255.255.0.0"),
+    ("router-eth2", "10:00:00:00:00:03", "172.16.42.1", "255.255.255.0"),
+]
+
+'''
+Class:          BenchInterface / BenchNet
+Description:    Just enough of an LLNetBase for ForwardingTable to populate itself
+'''
+class BenchInterface:
+    def __init__(self, name, ethaddr, ipaddr, netmask):
+        from switchyard.lib.userlib import EthAddr
+        self.name    = name
+        self.ethaddr = EthAddr(ethaddr)
+        self.ipaddr  = IPv4Address(ipaddr)
+        self.netmask = IPv4Address(netmask)
+
+class BenchNet:
+    def __init__(self):
+        self.intfs = [BenchInterface(*x) for x in INTERFACES]
+
+    def interfaces(self):
+        return self.intfs
+
+    def interface_by_name(self, name):
+        for intf in self.intfs:
+            if intf.name == name: return intf
+        raise KeyError(name)
+
+#Stand-in for the IPv4 header lookup_route reads the destination from
+class BenchHeader:
+    __slots__ = ('dst',)
+
+    def __init__(self, dst):
+        self.dst = dst
+
+'''
+make_table
+Generates <count> distinct routes as (prefix, prefix length, next hop, interface name)
+'''
+def make_table(count, rng):
+    lengths = list(PREFIX_LENGTHS.keys())
+    weights = list(PREFIX_LENGTHS.values())
+    hops    = [(int(IPv4Address("192.168.1.2")), "router-eth0"),
+               (int(IPv4Address("10.10.0.254")), "router-eth1"),
+               (int(IPv4Address("10.10.1.254")), "router-eth1"),
+               (int(IPv4Address("172.16.42.2")), "router-eth2")]
+
+    seen   = set()
+    routes = []
+    while len(routes) < count:
+        plen   = rng.choices(lengths, weights)[0]
+        prefix = rng.getrandbits(32) & ((0xFFFFFFFF << (32 - plen)) & 0xFFFFFFFF)
+        if prefix >> 24 in (0, 10, 127, 172, 192) or (prefix, plen) in seen: continue
+        seen.add((prefix, plen))
+        hop, name = rng.choice(hops)
+        routes.append((prefix, plen, hop, name))
+
+    return routes
+
+'''
+make_stream
+Generates <count> destinations inside the routes, picked uniformly or with a
+Zipf-like skew towards a few popular routes
+'''
+def make_stream(routes, count, kind, rng):
+    if kind == "zipf":
+        weights = [1.0 / (rank + 1) for rank in range(len(routes))]
+        picks   = rng.choices(routes, weights, k=count)
+    else:
+        picks   = [rng.choice(routes) for i in range(count)]
+
+    return [prefix | (rng.getrandbits(32) & ((1 << (32 - plen)) - 1)) for prefix, plen, _, _ in picks]
+
+def write_table(routes, filename):
+    with open(filename, 'w') as fh:
+        for prefix, plen, hop, name in routes:
+            mask = (0xFFFFFFFF << (32 - plen)) & 0xFFFFFFFF
+            fh.write("{} {} {} {}\n".format(IPv4Address(prefix), IPv4Address(mask), IPv4Address(hop), name))
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+'''
+run_case
+Runs one (size, backend) case in the current process and returns its results
+'''
+def run_case(size, backend, lookups, stream, seed):
+    import myrouter_part3 as router
+
+    rng    = random.Random(seed)
+    routes = make_table(size, rng)
+    dsts   = make_stream(routes, lookups, stream, rng)
+    lpm    = "trie" if backend == "batch" else backend
+    result = {'size': size, 'backend': backend}
+
+    def new_table():
+        return router.ForwardingTable(BenchNet(), size = size, backend = lpm)
+
+    #Insert
+    table   = new_table()
+    port_id = {intf.name: table.get_port_id(intf.ethaddr) for intf in table._net_.interfaces()}
+    start = time.perf_counter()
+    for prefix, plen, hop, name in routes:
+        table.add_route(prefix, plen, hop, port_id[name], False)
+    result['insert_s'] = time.perf_counter() - start
+
+    #Load, text then compiled
+    with tempfile.TemporaryDirectory() as tmp:
+        text = os.path.join(tmp, "forwarding_table.txt")
+        write_table(routes, text)
+
+        start = time.perf_counter()
+        new_table().load_file(text)
+        result['load_text_s'] = time.perf_counter() - start
+
+        router.ForwardingTable.compile_file(text)
+        start = time.perf_counter()
+        new_table().load_file(text)
+        result['load_compiled_s'] = time.perf_counter() - start
+
+    #Lookup
+    if backend == "batch":
+        table.lookup_routes(dsts[:1])                   #Build the prefix arrays
+        start = time.perf_counter()
+        table.lookup_routes(dsts)
+        elapsed = time.perf_counter() - start
+        result['lookups_per_s'] = lookups / elapsed
+        result['p50_ns'] = result['p99_ns'] = None          #No per-lookup latency
+    else:
+        headers = [BenchHeader(IPv4Address(dst)) for dst in dsts]
+        lookup  = table.lookup_route
+
+        start = time.perf_counter()
+        for head in headers:
+            lookup(head)
+        result['lookups_per_s'] = lookups / (time.perf_counter() - start)
+
+        latency = []
+        clock   = time.perf_counter_ns
+        for head in headers[:min(lookups, 50000)]:
+            t0 = clock()
+            lookup(head)
+            latency.append(clock() - t0)
+        result['p50_ns'] = percentile(latency, 50)
+        result['p99_ns'] = percentile(latency, 99)
+
+    result['peak_rss_mb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return result
+
+def print_results(results):
+    header = "{:>9} {:>7} {:>10} {:>10} {:>10} {:>12} {:>9} {:>9} {:>9}".format(
+                "routes", "backend", "insert s", "load txt", "load bin",
+                "lookups/s", "p50 ns", "p99 ns", "RSS MB")
+    print(header)
+    print("-" * len(header))
+    for r in results:
+        p50, p99 = ("n/a" if ns is None else "{:.0f}".format(ns) for ns in (r['p50_ns'], r['p99_ns']))
+        print("{:>9} {:>7} {:>10.3f} {:>10.3f} {:>10.3f} {:>12,.0f} {:>9} {:>9} {:>9.1f}".format(
+                r['size'], r['backend'], r['insert_s'], r['load_text_s'], r['load_compiled_s'],
+                r['lookups_per_s'], p50, p99, r['peak_rss_mb']))
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark ForwardingTable backends")
+    parser.add_argument("--sizes",    default="1000,10000,100000,1000000")
+    parser.add_argument("--backends", default="trie,dir24,batch")
+    parser.add_argument("--lookups",  type=int, default=200000)
+    parser.add_argument("--stream",   choices=("uniform", "zipf"), default="uniform")
+    parser.add_argument("--seed",     type=int, default=640)
+    parser.add_argument("--case",     nargs=2, metavar=("SIZE", "BACKEND"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.case:
+        result = run_case(int(args.case[0]), args.case[1], args.lookups, args.stream, args.seed)
+        print(json.dumps(result))
+        return
+
+    results = []
+    for size in [int(x) for x in args.sizes.split(",")]:
+        for backend in args.backends.split(","):
+            cmd = [sys.executable, os.path.abspath(__file__), "--case", str(size), backend,
+                   "--lookups", str(args.lookups), "--stream", args.stream, "--seed", str(args.seed)]
+            out = subprocess.run(cmd, stdout=subprocess.PIPE, cwd=os.path.dirname(os.path.abspath(__file__)))
+            if out.returncode != 0:
+                print("Case {} {} failed".format(size, backend), file=sys.stderr)
+                continue
+            results.append(json.loads(out.stdout.decode().strip().splitlines()[-1]))
+
+    print_results(results)
+
+if __name__ == "__main__":
+    main()
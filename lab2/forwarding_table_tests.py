@@ -0,0 +1,253 @@
+'''
+Script tests for the part 3 forwarding table and router fast paths
+Deterministic (fixed random seeds); run from lab2 with switchyard importable:
+    python3 forwarding_table_tests.py
+'''
+import os
+import random
+import tempfile
+
+from switchyard.lib.userlib import *
+from switchyard.lib.packet import *
+
+from myrouter_part3 import ForwardingTable, PrefixTrie, Router
+
+'''
+Class:          FakeInterface
+Description:    The interface fields the router reads from switchyard
+'''
+class FakeInterface(object):
+    def __init__(self, name, ethaddr, ipaddr, netmask):
+        self.name    = name
+        self.ethaddr = EthAddr(ethaddr)
+        self.ipaddr  = IPv4Address(ipaddr)
+        self.netmask = IPv4Address(netmask)
+#end class FakeInterface
+
+'''
+Class:          FakeNet
+Description:    Stand-in for the switchyard net object with the lab's three router
+                interfaces. recv_packet hands out the (timestamp, port name, packet)
+                tuples in inbox, then shuts the router down. Sent packets are
+                recorded as (port name, packet)
+'''
+class FakeNet(object):
+    def __init__(self):
+        self.intfs = [FakeInterface('router-eth0', '10:00:00:00:00:01', '192.168.1.1', '255.255.255.252'),
+                      FakeInterface('router-eth1', '10:00:00:00:00:02', '10.10.0.1', '255.255.0.0'),
+                      FakeInterface('router-eth2', '10:00:00:00:00:03', '172.16.42.1', '255.255.255.0')]
+        self.inbox = []
+        self.sent  = []
+
+    def interfaces(self):
+        return self.intfs
+
+    def interface_by_name(self, name):
+        for intf in self.intfs:
+            if intf.name == name: return intf
+        raise KeyError("No such interface: {}".format(name))
+
+    def recv_packet(self, timeout = None):
+        if not self.inbox: raise Shutdown()
+        return self.inbox.pop(0)
+
+    def send_packet(self, port, pkt):
+        self.sent.append((port, pkt))
+#end class FakeNet
+
+'''
+linear_lookup
+Reference longest prefix match: scans every live route in the table
+Returns the (prefix, prefix length) of the match, or None
+'''
+def linear_lookup(table: ForwardingTable, dst):
+    best = None
+    for row in range(len(table.status)):
+        if table.status[row] == ForwardingTable.ROW_FREE: continue
+        prefix, plen = table.net_prfx[row], table.net_plen[row]
+        if dst & PrefixTrie.MASKS[plen] == prefix and (best is None or plen > best[1]):
+            best = (prefix, plen)
+    return best
+
+'''
+table_lookup
+Longest prefix match through the table's lookup backend
+Returns the (prefix, prefix length) of the match, or None
+'''
+def table_lookup(table: ForwardingTable, dst):
+    row = table.lpm.lookup(dst)
+    return None if row is None else (table.net_prfx[row], table.net_plen[row])
+
+'''
+add_random_routes
+Adds <count> random non-local routes inside 10.0.0.0/12, so prefixes nest and
+collide; the table evicts down to its capacity as they are added
+'''
+def add_random_routes(rnd, table: ForwardingTable, count, plens):
+    for _ in range(count):
+        plen   = rnd.choice(plens)
+        prefix = (0x0A000000 | rnd.getrandbits(20)) & PrefixTrie.MASKS[plen]
+        hop    = 0x0A0A0000 | rnd.randrange(1, 4)
+        table.add_route(prefix, plen, hop, rnd.randrange(len(table.ports)), False)
+
+'''
+random_addrs
+Destinations to probe: addresses inside the table's routes, plus random ones
+'''
+def random_addrs(rnd, table: ForwardingTable, count):
+    rows  = [row for row in range(len(table.status)) if table.status[row] != ForwardingTable.ROW_FREE]
+    addrs = []
+    for i in range(count):
+        if i % 4 == 0:
+            addrs.append(rnd.getrandbits(32))
+            continue
+        row = rnd.choice(rows)
+        addrs.append(table.net_prfx[row] | rnd.getrandbits(32) & ~PrefixTrie.MASKS[table.net_plen[row]] & 0xFFFFFFFF)
+    return addrs
+
+'''
+route_set
+Returns a table's routes as comparable (prefix, mask, next hop, port, is_local) tuples
+'''
+def route_set(table: ForwardingTable):
+    return set((str(e.net_prfx), str(e.net_mask), str(e.nxt_addr), str(e.nxt_port), e.is_local)
+                    for e in table.entries())
+
+def test_compiled_round_trip():
+    rnd = random.Random(5)
+    with tempfile.TemporaryDirectory() as tmp:
+        text = os.path.join(tmp, "table.txt")
+        with open(text, 'w') as fh:
+            for _ in range(300):
+                plen = rnd.randrange(8, 33)
+                net  = IPv4Address(rnd.getrandbits(32) & PrefixTrie.MASKS[plen])
+                hop  = IPv4Address(0x0A0A0000 | rnd.randrange(1, 256))
+                fh.write("{} {} {} router-eth{}\n".format(net, IPv4Address(PrefixTrie.MASKS[plen]), hop, rnd.randrange(3)))
+
+        from_text = ForwardingTable(FakeNet(), size = 1000)
+        assert from_text.load_file(text)
+
+        ForwardingTable.compile_file(text)
+        compiled = ForwardingTable.compiled_name(text)
+        from_bin = ForwardingTable(FakeNet(), size = 1000)
+        assert from_bin.load_compiled(compiled)
+        assert route_set(from_bin) == route_set(from_text)
+
+        #Corrupt the last record's prefix length: nothing may be loaded from it
+        with open(compiled, 'r+b') as fh:
+            fh.seek(-ForwardingTable.RECORD.size + 4, os.SEEK_END)
+            fh.write(bytes([40]))
+        corrupt = ForwardingTable(FakeNet(), size = 1000)
+        local   = route_set(corrupt)
+        assert not corrupt.load_compiled(compiled)
+        assert route_set(corrupt) == local
+
+        #load_file falls back to the text table
+        os.utime(compiled)
+        fallback = ForwardingTable(FakeNet(), size = 1000)
+        assert fallback.load_file(text)
+        assert route_set(fallback) == route_set(from_text)
+
+def test_trie_matches_linear_scan():
+    rnd = random.Random(4)
+    for policy in ("fifo", "lru", "lfu"):
+        table = ForwardingTable(FakeNet(), size = 64, policy = policy)
+        for _ in range(20):
+            add_random_routes(rnd, table, 50, (8, 12, 16, 20, 24, 28, 32))
+            for dst in random_addrs(rnd, table, 200):
+                assert table_lookup(table, dst) == linear_lookup(table, dst), (policy, IPv4Address(dst))
+                table.lookup_addr(dst)                  #Feeds LRU/LFU so evictions vary
+
+def test_dir24_matches_linear_scan():
+    rnd = random.Random(7)
+    for policy in ("fifo", "lru", "lfu"):
+        table = ForwardingTable(FakeNet(), size = 64, policy = policy, backend = "dir24")
+        for _ in range(20):
+            add_random_routes(rnd, table, 50, (8, 16, 20, 23, 24, 25, 26, 28, 30, 32))
+            for dst in random_addrs(rnd, table, 200):
+                assert table_lookup(table, dst) == linear_lookup(table, dst), (policy, IPv4Address(dst))
+                table.lookup_addr(dst)
+
+            #Only /24 slots still holding a route longer than /24 keep a tbl8 chunk
+            slots = set(table.net_prfx[row] >> 8 for row in range(len(table.status))
+                            if table.status[row] != ForwardingTable.ROW_FREE and table.net_plen[row] > 24)
+            dir24 = table.dir24
+            assert dir24.chunks - len(dir24.free_chunks) == len(slots), policy
+
+def test_compress_keeps_forwarding():
+    rnd = random.Random(9)
+    for backend in ("trie", "dir24"):
+        table = ForwardingTable(FakeNet(), size = 4096, backend = backend)
+        add_random_routes(rnd, table, 1000, (16, 20, 22, 23, 24, 25, 26))
+
+        #Sibling pairs with one next hop, which compress can merge
+        for _ in range(200):
+            plen   = rnd.choice((20, 24, 26))
+            prefix = (0x0A000000 | rnd.getrandbits(20)) & PrefixTrie.MASKS[plen - 1]
+            table.add_route(prefix, plen, 0x0A0A0001, 1, False)
+            table.add_route(prefix | 1 << (32 - plen), plen, 0x0A0A0001, 1, False)
+
+        dsts   = random_addrs(rnd, table, 5000)
+        before = [table.lookup_addr(dst) for dst in dsts]
+        count, compressed = table.compress()
+        assert compressed < count, backend
+        assert [table.lookup_addr(dst) for dst in dsts] == before, backend
+
+'''
+ipv4_checksum_ok
+True if the IPv4 header of an Ethernet frame sums to 0xFFFF, i.e. its checksum verifies
+'''
+def ipv4_checksum_ok(frame):
+    header = frame[14:14 + (frame[14] & 0x0F) * 4]
+    total  = sum(int.from_bytes(header[i:i + 2], 'big') for i in range(0, len(header), 2))
+    while total >> 16:
+        total = (total & 0xFFFF) + (total >> 16)
+    return total == 0xFFFF
+
+def test_fast_path_checksum():
+    rnd = random.Random(25)
+    net = FakeNet()
+    router = Router(net, ipv4_fast_path = True)
+    router.other_proto_eth.add_mapping(IPv4Address('10.10.1.254'), EthAddr('20:00:00:00:00:02'))
+
+    for ttl in list(range(2, 256)) * 4:
+        ether = Ethernet(src='30:00:00:00:00:01', dst='10:00:00:00:00:01', ethertype=EtherType.IP)
+        ippkt = IPv4(src=IPv4Address(rnd.getrandbits(32)), dst=IPv4Address(0xAC104000 | rnd.getrandbits(14)),
+                     protocol=IPProtocol.ICMP, ttl=ttl, ipid=rnd.getrandbits(16))
+        frame = (ether + ippkt + ICMP()).to_bytes()
+        assert ipv4_checksum_ok(frame)
+
+        assert router.forward_fast(Packet(raw=frame)), ttl
+        port, pkt = net.sent.pop()
+        out = pkt.to_bytes()
+        assert port == 'router-eth1' and out[22] == ttl - 1, ttl
+        assert ipv4_checksum_ok(out), (ttl, out[14:34].hex())
+        assert out[34:] == frame[34:]
+
+def test_fast_path_keeps_flow_order():
+    net = FakeNet()
+    router = Router(net, ipv4_fast_path = True, recv_batch = 8)
+
+    #The first packet waits on the object path for 10.10.1.254; the ARP reply
+    #resolves it mid-batch, so the second one could otherwise overtake it
+    def ip_frame(ipid):
+        ether = Ethernet(src='30:00:00:00:00:01', dst='10:00:00:00:00:01', ethertype=EtherType.IP)
+        ippkt = IPv4(src='192.168.1.100', dst='172.16.64.5', protocol=IPProtocol.ICMP, ttl=64, ipid=ipid)
+        return Packet(raw=(ether + ippkt + ICMP()).to_bytes())
+
+    ether = Ethernet(src='20:00:00:00:00:02', dst='10:00:00:00:00:02', ethertype=EtherType.ARP)
+    arp   = Arp(operation=ArpOperation.Reply, senderhwaddr='20:00:00:00:00:02', senderprotoaddr='10.10.1.254',
+                targethwaddr='10:00:00:00:00:02', targetprotoaddr='10.10.0.1')
+    net.inbox = [(0, 'router-eth0', ip_frame(1)),
+                 (0, 'router-eth1', ether + arp),
+                 (0, 'router-eth0', ip_frame(2))]
+    router.router_main()
+
+    sent = [Packet(raw=pkt.to_bytes())[IPv4].ipid for port, pkt in net.sent if port == 'router-eth1']
+    assert sent == [1, 2], sent
+
+if __name__ == '__main__':
+    for name, test in sorted(globals().items()):
+        if name.startswith("test_"):
+            test()
+            print("{}: passed".format(name))
@@ -6,30 +6,618 @@ Course:         UWCS 640, Section 2, Fall 2019
 '''
 import sys
 import os
+import ast
+import copy
 import time
+import mmap
+import heapq
+import struct
+import threading
+
+from collections import Counter, OrderedDict, deque
+
+try:
+    import numpy as np                          #Optional: only needed for lookup_routes
+except ImportError:
+    np = None
 
 from dynamicroutingmessage import DynamicRoutingMessage
 from switchyard.lib.packet.util import *
 from switchyard.lib.userlib import *
+from switchyard.pcapffi import PcapException
 from switchyard.llnetbase import LLNetBase
 
+from array import array                         #After the wildcards: switchyard exports the array module
+
+import tracing
+
+TRACE = tracing.get_tracer("router")
+
+'''
+Class:          PrefixTrie
+Description:    Path-compressed binary (Patricia) trie for longest prefix matching
+                Prefixes and addresses are stored as 32-bit integers. Nodes live in
+                parallel arrays (prefix, length, value, left/right child) so each
+                node costs 17 bytes instead of a Python object. Values are
+                non-negative integers; -1 marks a valueless glue node.
+                Lookup cost depends on the prefix length, not on the number of routes
+'''
+class PrefixTrie:
+    MASKS = tuple((0xFFFFFFFF << (32 - i)) & 0xFFFFFFFF for i in range(33))
+
+    def __init__(self):
+        #Node 0 is the /0 root; it is never a child, so 0 also means "no child"
+        self.prefix = array('I', [0])
+        self.plen   = array('B', [0])
+        self.value  = array('i', [-1])
+        self.left   = array('I', [0])
+        self.right  = array('I', [0])
+        self.free   = []
+        self.count  = 0
+
+    def __len__(self):
+        return self.count
+
+    '''
+    insert
+    Adds or replaces the value stored for a prefix
+      prefix    Network prefix as a 32-bit integer (host bits must be zero)
+      plen      Prefix length, 0-32
+      value     Non-negative integer to store for the prefix
+    '''
+    def insert(self, prefix, plen, value):
+        node = 0
+        while True:
+            if self.plen[node] == plen:
+                if self.value[node] < 0: self.count += 1
+                self.value[node] = value
+                return
+
+            bit   = PrefixTrie.bit_at(prefix, self.plen[node])
+            child = self.get_child(node, bit)
+
+            if not child:
+                self.set_child(node, bit, self.new_node(prefix, plen, value))
+                self.count += 1
+                return
+
+            child_plen = self.plen[child]
+            common = PrefixTrie.common_len(self.prefix[child], prefix, min(child_plen, plen))
+            if common == child_plen:
+                node = child
+                continue
+
+            #New prefix sits between node and child
+            if common == plen:
+                new_node = self.new_node(prefix, plen, value)
+                self.set_child(new_node, PrefixTrie.bit_at(self.prefix[child], plen), child)
+                self.set_child(node, bit, new_node)
+                self.count += 1
+                return
+
+            #Prefixes diverge below node; join them with a valueless glue node
+            glue = self.new_node(prefix & PrefixTrie.MASKS[common], common, -1)
+            self.set_child(glue, PrefixTrie.bit_at(self.prefix[child], common), child)
+            self.set_child(glue, PrefixTrie.bit_at(prefix, common), self.new_node(prefix, plen, value))
+            self.set_child(node, bit, glue)
+            self.count += 1
+            return
+
+    '''
+    find
+    Exact-match search for a prefix
+      prefix    Network prefix as a 32-bit integer
+      plen      Prefix length, 0-32
+    Returns the value stored for the prefix, or None if it is not present
+    '''
+    def find(self, prefix, plen):
+        node = self.descend(prefix, plen)[-1]
+        if self.plen[node] != plen or self.prefix[node] != prefix or self.value[node] < 0:
+            return None
+        return self.value[node]
+
+    '''
+    remove
+    Removes the value stored for a prefix, collapsing glue nodes left behind
+      prefix    Network prefix as a 32-bit integer
+      plen      Prefix length, 0-32
+    Returns the removed value, or None if the prefix was not present
+    '''
+    def remove(self, prefix, plen):
+        path = self.descend(prefix, plen)
+        node = path[-1]
+        if self.plen[node] != plen or self.prefix[node] != prefix or self.value[node] < 0:
+            return None
+
+        value = self.value[node]
+        self.value[node] = -1
+        self.count -= 1
+
+        #Splice out the node if it no longer carries a value or a branch point
+        if node != 0:
+            self.prune(path[-2], node)
+            if len(path) > 2 and self.value[path[-2]] < 0:
+                self.prune(path[-3], path[-2])
+
+        return value
+
+    '''
+    lookup
+    Finds the value of the longest prefix containing an address
+      addr      IPv4 address as a 32-bit integer
+    Returns the stored value, or None if no prefix matches
+    '''
+    def lookup(self, addr):
+        masks  = PrefixTrie.MASKS
+        n_pfx  = self.prefix
+        n_plen = self.plen
+        n_val  = self.value
+
+        best = -1
+        node = 0
+        while True:
+            plen = n_plen[node]
+            if (addr ^ n_pfx[node]) & masks[plen]: break
+            if n_val[node] >= 0: best = n_val[node]
+            if plen == 32: break
+            node = self.right[node] if (addr >> (31 - plen)) & 1 else self.left[node]
+            if not node: break
+
+        return best if best >= 0 else None
+
+    '''
+    covering
+    Finds the longest prefix strictly shorter than <plen> that contains <prefix>
+      prefix    Network prefix as a 32-bit integer
+      plen      Prefix length, 0-32
+    Returns (value, prefix length), or (None, 0) if no shorter prefix matches
+    '''
+    def covering(self, prefix, plen):
+        best     = -1
+        best_len = 0
+        node     = 0
+        while True:
+            node_plen = self.plen[node]
+            if node_plen >= plen or (prefix ^ self.prefix[node]) & PrefixTrie.MASKS[node_plen]: break
+            if self.value[node] >= 0:
+                best     = self.value[node]
+                best_len = node_plen
+            node = self.get_child(node, PrefixTrie.bit_at(prefix, node_plen))
+            if not node: break
+
+        return (best if best >= 0 else None), best_len
+
+    def memory_usage(self):
+        return sum(col.itemsize * len(col) for col in (self.prefix, self.plen, self.value, self.left, self.right))
+
+    #Returns the list of nodes from the root towards prefix, stopping at plen
+    def descend(self, prefix, plen):
+        path = [0]
+        node = 0
+        while self.plen[node] < plen:
+            if (prefix ^ self.prefix[node]) & PrefixTrie.MASKS[self.plen[node]]: break
+            node = self.get_child(node, PrefixTrie.bit_at(prefix, self.plen[node]))
+            if not node: break
+            path.append(node)
+        return path
+
+    def prune(self, parent, node):
+        if self.value[node] >= 0: return
+        left, right = self.left[node], self.right[node]
+        if left and right: return
+        self.set_child(parent, PrefixTrie.bit_at(self.prefix[node], self.plen[parent]), left or right)
+        self.free.append(node)
+
+    def new_node(self, prefix, plen, value):
+        if self.free:
+            node = self.free.pop()
+            self.prefix[node] = prefix
+            self.plen[node]   = plen
+            self.value[node]  = value
+            self.left[node]   = 0
+            self.right[node]  = 0
+            return node
+
+        self.prefix.append(prefix)
+        self.plen.append(plen)
+        self.value.append(value)
+        self.left.append(0)
+        self.right.append(0)
+        return len(self.prefix) - 1
+
+    def get_child(self, node, bit):
+        return self.right[node] if bit else self.left[node]
+
+    def set_child(self, node, bit, child):
+        if bit: self.right[node] = child
+        else:   self.left[node]  = child
+
+    @staticmethod
+    def mask(plen):
+        return PrefixTrie.MASKS[plen]
+
+    @staticmethod
+    def bit_at(value, pos):
+        return (value >> (31 - pos)) & 1
+
+    @staticmethod
+    def common_len(a, b, limit):
+        diff = (a ^ b) & PrefixTrie.MASKS[limit]
+        if diff == 0: return limit
+        return 32 - diff.bit_length()
+#end class PrefixTrie
+
+'''
+Class:          Dir24Table
+Description:    DIR-24-8 direct-indexed lookup table, mirroring the routes in a PrefixTrie
+                tbl24 has one slot per /24. A slot holds row+1 of its route (0 => none),
+                or CHUNK|n when some route longer than /24 falls inside it, in which
+                case tbl8 chunk n holds one entry per address of that /24.
+                len24/len8 keep the prefix length that filled each slot so routes can
+                be added and removed incrementally in any order. A chunk is freed once
+                its last route longer than /24 is removed, and reused by the next split.
+                Every lookup costs one or two array indexes
+'''
+class Dir24Table:
+    CHUNK = 0x80000000
+
+    def __init__(self, trie: PrefixTrie):
+        self.trie   = trie
+        self.tbl24  = array('I', [0]) * (1 << 24)
+        self.len24  = array('B', [0]) * (1 << 24)
+        self.tbl8   = array('I')
+        self.len8   = array('B')
+        self.chunks = 0                 #tbl8 chunks allocated
+        self.free_chunks = []           #Chunks no longer used by any /24 slot
+
+    '''
+    lookup
+    Finds the row of the longest prefix containing an address
+      addr      IPv4 address as a 32-bit integer
+    Returns the row, or None if no prefix matches
+    '''
+    def lookup(self, addr):
+        v = self.tbl24[addr >> 8]
+        if v & Dir24Table.CHUNK:
+            v = self.tbl8[((v & 0x7FFFFFFF) << 8) | (addr & 0xFF)]
+        return v - 1 if v else None
+
+    '''
+    add
+    Points every address covered by a route, and not covered by a longer one, at it
+      prefix    Network prefix as a 32-bit integer
+      plen      Prefix length, 0-32
+      row       Forwarding table row of the route
+    '''
+    def add(self, prefix, plen, row):
+        value = row + 1
+
+        if plen > 24:
+            base  = self.get_chunk(prefix >> 8) << 8
+            first = base | (prefix & 0xFF)
+            for i in range(first, first + (1 << (32 - plen))):
+                if self.len8[i] <= plen:
+                    self.tbl8[i] = value
+                    self.len8[i] = plen
+            return
+
+        first = prefix >> 8
+        last  = first + (1 << (24 - plen))
+        for start in range(first, last, 256):
+            end = min(start + 256, last)
+
+            #Whole block is shorter routes or empty: fill it in one go
+            if max(self.tbl24[start:end]) < Dir24Table.CHUNK and max(self.len24[start:end]) <= plen:
+                self.tbl24[start:end] = array('I', [value]) * (end - start)
+                self.len24[start:end] = array('B', [plen]) * (end - start)
+                continue
+
+            for slot in range(start, end):
+                v = self.tbl24[slot]
+                if v & Dir24Table.CHUNK:
+                    base = (v & 0x7FFFFFFF) << 8
+                    for i in range(base, base + 256):
+                        if self.len8[i] <= plen:
+                            self.tbl8[i] = value
+                            self.len8[i] = plen
+                elif self.len24[slot] <= plen:
+                    self.tbl24[slot] = value
+                    self.len24[slot] = plen
+
+    '''
+    remove
+    Hands every address a removed route was serving to its covering route.
+    Must be called after the route has been removed from the trie
+      prefix    Network prefix as a 32-bit integer
+      plen      Prefix length, 0-32
+      row       Forwarding table row the route used
+    '''
+    def remove(self, prefix, plen, row):
+        value = row + 1
+        cover, cover_len = self.trie.covering(prefix, plen)
+        new_value = cover + 1 if cover is not None else 0
+
+        if plen > 24:
+            slot = prefix >> 8
+            v    = self.tbl24[slot]
+            if not v & Dir24Table.CHUNK: return
+            chunk = v & 0x7FFFFFFF
+            base  = chunk << 8
+            first = base | (prefix & 0xFF)
+            for i in range(first, first + (1 << (32 - plen))):
+                if self.tbl8[i] == value:
+                    self.tbl8[i] = new_value
+                    self.len8[i] = cover_len
+
+            #No route longer than /24 left: every entry holds the slot's covering
+            #route, so fold the chunk back into tbl24 and free it
+            if max(self.len8[base:base + 256]) <= 24:
+                self.tbl24[slot] = self.tbl8[base]
+                self.len24[slot] = self.len8[base]
+                self.free_chunks.append(chunk)
+            return
+
+        first = prefix >> 8
+        last  = first + (1 << (24 - plen))
+        for start in range(first, last, 256):
+            end = min(start + 256, last)
+
+            #Whole block belongs to the removed route: hand it over in one go
+            if self.tbl24[start:end].count(value) == end - start:
+                self.tbl24[start:end] = array('I', [new_value]) * (end - start)
+                self.len24[start:end] = array('B', [cover_len]) * (end - start)
+                continue
+
+            for slot in range(start, end):
+                v = self.tbl24[slot]
+                if v & Dir24Table.CHUNK:
+                    base = (v & 0x7FFFFFFF) << 8
+                    for i in range(base, base + 256):
+                        if self.tbl8[i] == value:
+                            self.tbl8[i] = new_value
+                            self.len8[i] = cover_len
+                elif v == value:
+                    self.tbl24[slot] = new_value
+                    self.len24[slot] = cover_len
+
+    #Returns the tbl8 chunk of a /24 slot, splitting the slot into a free or new chunk if needed
+    def get_chunk(self, slot):
+        v = self.tbl24[slot]
+        if v & Dir24Table.CHUNK: return v & 0x7FFFFFFF
+
+        if self.free_chunks:
+            chunk = self.free_chunks.pop()
+            base  = chunk << 8
+            self.tbl8[base:base + 256] = array('I', [v]) * 256
+            self.len8[base:base + 256] = array('B', [self.len24[slot]]) * 256
+        else:
+            chunk = self.chunks
+            self.chunks += 1
+            self.tbl8.extend(array('I', [v]) * 256)
+            self.len8.extend(array('B', [self.len24[slot]]) * 256)
+        self.tbl24[slot] = Dir24Table.CHUNK | chunk
+        return chunk
+
+    def memory_usage(self):
+        return sum(col.itemsize * len(col) for col in (self.tbl24, self.len24, self.tbl8, self.len8))
+#end class Dir24Table
+
+'''
+Class:          RouteCache
+Description:    Bounded LRU cache of destination -> (row, (port, next hop)) route results
+                Entries are tagged with the forwarding table generation they were
+                resolved under; a generation change flushes the whole cache so a
+                stale route is never served. Hit/miss counters help size the cache
+'''
+class RouteCache:
+    def __init__(self, size):
+        self.map        = OrderedDict()
+        self.size       = size
+        self.generation = 0
+        self.hits       = 0
+        self.misses     = 0
+
+    def __len__(self):
+        return len(self.map)
+
+    '''
+    get
+    Returns the cached route result for a destination, or None on a miss
+      dst           Destination IPv4 address as an integer
+      generation    Current forwarding table generation
+    '''
+    def get(self, dst, generation):
+        if generation != self.generation:
+            self.map.clear()
+            self.generation = generation
+
+        result = self.map.get(dst)
+        if result is None:
+            self.misses += 1
+            return None
+
+        self.map.move_to_end(dst)
+        self.hits += 1
+        return result
+
+    '''
+    put
+    Stores a route result, evicting the least recently used entry when full
+      dst           Destination IPv4 address as an integer
+      result        (row, (port, next hop)) tuple
+    '''
+    def put(self, dst, result):
+        self.map[dst] = result
+        self.map.move_to_end(dst)
+        if len(self.map) > self.size:
+            self.map.popitem(last=False)
+#end class RouteCache
+
+'''
+Class:          FIFOEviction
+Description:    Eviction policy that removes the oldest installed route. The
+                eviction policies share one interface, all operations but order O(1):
+                    insert(row) - start tracking a newly installed route
+                    touch(row)  - record a lookup hit on a route
+                    remove(row) - stop tracking a route
+                    evict()     - pick, untrack and return the route to evict
+                    order()     - tracked routes, the next one to evict first
+'''
+class FIFOEviction:
+    def __init__(self):
+        self.rows = OrderedDict()
+
+    def __len__(self):
+        return len(self.rows)
+
+    def insert(self, row):
+        self.rows[row] = None
+
+    def touch(self, row):
+        pass
+
+    def remove(self, row):
+        self.rows.pop(row, None)
+
+    def evict(self):
+        return self.rows.popitem(last=False)[0]
+
+    def order(self):
+        return list(self.rows)
+#end class FIFOEviction
+
+'''
+Class:          LRUEviction
+Description:    Eviction policy that removes the route least recently hit by a lookup
+'''
+class LRUEviction(FIFOEviction):
+    def touch(self, row):
+        if row in self.rows: self.rows.move_to_end(row)
+#end class LRUEviction
+
+'''
+Class:          LFUEviction
+Description:    Eviction policy that removes the route with the fewest lookup hits,
+                oldest first among ties. Routes are kept in per-count buckets so a
+                hit moves a route up one bucket in constant time
+'''
+class LFUEviction:
+    def __init__(self):
+        self.freq     = {}          #row -> hit count
+        self.buckets  = {}          #hit count -> rows, oldest first
+        self.min_freq = 0
+
+    def __len__(self):
+        return len(self.freq)
+
+    def insert(self, row):
+        self.freq[row] = 1
+        self.buckets.setdefault(1, OrderedDict())[row] = None
+        self.min_freq  = 1
+
+    def touch(self, row):
+        count = self.freq.get(row)
+        if count is None: return
+
+        self.unlink(row, count)
+        if count == self.min_freq and count not in self.buckets:
+            self.min_freq = count + 1
+
+        self.freq[row] = count + 1
+        self.buckets.setdefault(count + 1, OrderedDict())[row] = None
+
+    def remove(self, row):
+        count = self.freq.pop(row, None)
+        if count is not None: self.unlink(row, count)
+
+    def evict(self):
+        #min_freq can only go stale after remove() empties its bucket
+        if self.min_freq not in self.buckets:
+            self.min_freq = min(self.buckets)
+
+        row = next(iter(self.buckets[self.min_freq]))
+        self.remove(row)
+        return row
+
+    def order(self):
+        return [row for count in sorted(self.buckets) for row in self.buckets[count]]
+
+    def unlink(self, row, count):
+        bucket = self.buckets[count]
+        del bucket[row]
+        if not bucket: del self.buckets[count]
+#end class LFUEviction
+
+EVICTION_POLICIES = {
+    "fifo": FIFOEviction,
+    "lru":  LRUEviction,
+    "lfu":  LFUEviction,
+}
+
 '''
 Class:          ForwardingTable
-Description:    Implements a forwarding table with simple FIFO entry managment
-                Includes the following fields:
+Description:    Implements a forwarding table with pluggable entry managment
+                Routes are stored as rows in parallel integer columns:
                     net_prfx - Network prefix number
-                    net_mask - Network mask
-                    nxt_addr - Next hop IP address
-                    nxt_port - Port to forward packets through
-                Holds a maximum of <size>+#Local interface routes
+                    net_plen - Network prefix length
+                    nxt_addr - Next hop IP address (0 => directly connected)
+                    nxt_port - Index of the forwarding port in self.ports
+                    status   - ROW_FREE, ROW_REMOTE or ROW_LOCAL
+                    hits     - Number of lookups resolved by the route
+                Addresses are converted back to IPv4Address/EthAddr at the API boundary
+                Holds a maximum of <size>+#Local interface routes; non-local routes
+                are evicted by <policy>, one of EVICTION_POLICIES ("fifo", "lru", "lfu")
+                Route results are cached for up to <cache_size> destinations (0 disables)
+                Lookups go through <backend>: "trie" (PrefixTrie) or "dir24" (Dir24Table,
+                for mostly static tables; the trie is kept as the route index)
 '''
 class ForwardingTable:
-    def __init__(self, net: LLNetBase, size = 5):
-        self._net_ = net
-        self.table = {}
-        self.index = [None for i in range(size)]
-        self.i_ptr = 0
-        self.size  = size
+    ROW_FREE   = 0
+    ROW_REMOTE = 1
+    ROW_LOCAL  = 2
+
+    #Compiled table file layout
+    MAGIC  = b'FTB1'
+    HEADER = struct.Struct('!4sHI')         #magic, name count, record count
+    NAME   = struct.Struct('16s')           #interface name
+    RECORD = struct.Struct('!IBxHI')        #prefix, prefix length, name index, next hop
+
+    def __init__(self, net: LLNetBase, size = 5, cache_size = 0, policy = "fifo", backend = "trie"):
+        if policy not in EVICTION_POLICIES:
+            raise ValueError("Unknown eviction policy: {}".format(policy))
+        if backend not in ("trie", "dir24"):
+            raise ValueError("Unknown lookup backend: {}".format(backend))
+
+        self._net_  = net
+        self.trie   = PrefixTrie()
+        self.dir24  = Dir24Table(self.trie) if backend == "dir24" else None
+        self.lpm    = self.dir24 if self.dir24 is not None else self.trie
+        self.policy = EVICTION_POLICIES[policy]()
+        self.size   = size
+
+        #Route columns, indexed by row
+        self.net_prfx  = array('I')
+        self.net_plen  = array('B')
+        self.nxt_addr  = array('I')
+        self.nxt_port  = array('H')
+        self.status    = array('B')
+        self.hits      = array('Q')
+        self.free_rows = []
+
+        #Next hop -> {port id: non-local routes using it}, kept by new_row/remove_row
+        self.hop_refs  = {}
+
+        #Port index table
+        self.ports    = []
+        self.port_ids = {}
+
+        #Bumped on every table change to invalidate cached route results
+        self.generation = 0
+        self.cache = RouteCache(cache_size) if cache_size > 0 else None
+
+        #Prefix arrays for lookup_routes, rebuilt when the generation changes
+        self.batch_generation = None
+        self.batch_levels     = []
 
         #Populate table based on net object
         for intf in net.interfaces():
@@ -40,10 +628,13 @@ class ForwardingTable:
 
             self.add_entry(network, None, mac_addr, True)
 
+    def __len__(self):
+        return len(self.status) - len(self.free_rows)
+
     '''
     add_entry
     Adds or updates a new entry to the forwarding table. Maintains a limited table
-    of non-local routes, stored in a FIFO index.
+    of non-local routes, evicted according to the table's eviction policy.
     Parameters:
         network     - network+mask string descriptor, ie "172.95.0.0\\16" or "172.95.0.0 255.255.0.0"
         next_hop    - IPv4 address of next hop (if it exists)
@@ -51,37 +642,98 @@ class ForwardingTable:
         is_local    - True => entry is from a local port; False otherwise
     '''
     def add_entry(self, network, next_hop, port, is_local):
-        log_debug("FT: Add: {}, {}, {}, local: {}".format(str(network), str(next_hop), str(port), is_local))
+        TRACE.debug("FT: Add: {}, {}, {}, local: {}", network, next_hop, port, is_local)
 
         net_addr = IPv4Network(network)
+        hop      = int(next_hop) if next_hop is not None else 0
+
+        self.add_route(int(net_addr.network_address), net_addr.prefixlen, hop, self.get_port_id(port), is_local)
+
+    '''
+    add_route
+    Integer form of add_entry, used by the file loaders
+    Parameters:
+        prefix      - network prefix as a 32-bit integer
+        plen        - prefix length
+        hop         - next hop as a 32-bit integer (0 => directly connected)
+        port_id     - index of the forwarding port in self.ports
+        is_local    - True => entry is from a local port; False otherwise
+    Returns the row of the route
+    '''
+    def add_route(self, prefix, plen, hop, port_id, is_local):
+        self.generation += 1
 
         #Update existing table entry
-        if net_addr in self.table:
-            self.table[net_addr].next_hop = next_hop
-            self.table[net_addr].port = port
-            return
+        row = self.trie.find(prefix, plen)
+        if row is not None:
+            self.ref_next_hop(row, -1)
+            self.nxt_addr[row] = hop
+            self.nxt_port[row] = port_id
+            self.ref_next_hop(row, 1)
+            return row
+
+        #Evict an old entry to make room if not-local
+        if not is_local and len(self.policy) >= self.size:
+            self.remove_row(self.policy.evict())
 
         #Add new entry
-        self.table[net_addr] = ForwardingTable.FTabEntry(
-                                    net_addr.network_address,
-                                    net_addr.netmask,
-                                    next_hop,
-                                    port,
-                                    is_local
-        )
+        status = ForwardingTable.ROW_LOCAL if is_local else ForwardingTable.ROW_REMOTE
+        row = self.new_row(prefix, plen, hop, port_id, status)
+        self.trie.insert(prefix, plen, row)
+        if self.dir24 is not None: self.dir24.add(prefix, plen, row)
+        if not is_local: self.policy.insert(row)
+        return row
 
-        #Update index and evict old entries if not-local
-        #This uses the same logic used for lab1, part 1
-        if not is_local:
-            if self.index[self.i_ptr] == None:
-                self.index[self.i_ptr] = net_addr
+    '''
+    compress
+    Shrinks the table without changing where any address is forwarded:
+        - drops non-local routes whose closest covering route has the same
+          next hop and port
+        - merges pairs of sibling non-local routes with the same next hop and
+          port into their parent prefix, if the parent is not already a route
+    Prefix lengths are processed longest first, so merged parents can merge again.
+    Meant for static tables: evicting a covering route afterwards changes
+    forwarding for the addresses its dropped more-specifics used to serve
+    Returns (route count before, route count after)
+    '''
+    def compress(self):
+        before = len(self)
+        remote = ForwardingTable.ROW_REMOTE
 
-            else:
-                evict = self.index[self.i_ptr]
-                del self.table[evict]
-                self.index[self.i_ptr] = net_addr
+        for plen in range(32, 0, -1):
+            rows = [row for row in range(len(self.status))
+                        if self.status[row] == remote and self.net_plen[row] == plen]
+
+            for row in rows:
+                #Skip rows merged away already, or reused by a merged parent
+                if self.status[row] != remote or self.net_plen[row] != plen: continue
+                prefix = self.net_prfx[row]
+
+                #Drop redundant more-specifics
+                cover, _ = self.trie.covering(prefix, plen)
+                if cover is not None and self.same_next_hop(cover, row):
+                    self.remove_row(row)
+                    continue
 
-            self.i_ptr = (self.i_ptr + 1) % self.size
+                #Merge with sibling into the parent prefix
+                sibling = self.trie.find(prefix ^ (1 << (32 - plen)), plen)
+                if sibling is None or self.status[sibling] != remote: continue
+                if not self.same_next_hop(sibling, row): continue
+
+                parent = prefix & PrefixTrie.MASKS[plen - 1]
+                if self.trie.find(parent, plen - 1) is not None: continue
+
+                hop, port_id = self.nxt_addr[row], self.nxt_port[row]
+                hits = self.hits[row] + self.hits[sibling]
+                self.remove_row(row)
+                self.remove_row(sibling)
+                self.hits[self.add_route(parent, plen - 1, hop, port_id, False)] = hits
+
+        log_debug("FT: Compressed {} routes to {}".format(before, len(self)))
+        return before, len(self)
+
+    def same_next_hop(self, a, b):
+        return self.nxt_addr[a] == self.nxt_addr[b] and self.nxt_port[a] == self.nxt_port[b]
 
     '''
     lookup_route
@@ -91,55 +743,368 @@ class ForwardingTable:
     route can be found, return None
     '''
     def lookup_route(self, ip_head: IPv4):
+        return self.lookup_addr(int(ip_head.dst))
 
-        #Get matching networks, sorted by prefix length larget > small
-        networks = sorted(
-                        filter(
-                            lambda x: ip_head.dst in x,
-                            self.table.keys()
-                        ),
-                        key=lambda x: x.prefixlen,
-                        reverse=True
-        )
-
-        if len(networks) > 0:
-            port = self.table[networks[0]].nxt_port
-            addr = self.table[networks[0]].nxt_addr
-            if addr == None: addr = ip_head.dst         #Local destination
+    '''
+    lookup_addr
+    lookup_route for a destination address given as an int
+    '''
+    def lookup_addr(self, dst):
+        if self.cache is not None:
+            cached = self.cache.get(dst, self.generation)
+            if cached is not None:
+                row, result = cached
+                self.hits[row] += 1
+                self.policy.touch(row)
+                return result
+
+        #Longest prefix match through the lookup backend
+        row = self.lpm.lookup(dst)
+
+        if row is not None:
+            self.hits[row] += 1
+            self.policy.touch(row)
+
+            port = self.ports[self.nxt_port[row]]
+            hop  = self.nxt_addr[row]
+            addr = IPv4Address(hop if hop else dst)             #0 => Local destination
+            if self.cache is not None: self.cache.put(dst, (row, (port, addr)))
             return port, addr
 
         return None
 
+    '''
+    entry
+    Converts a table row back into an FTabEntry of address objects
+      row       Row index, as returned by lookup_routes
+    '''
+    def entry(self, row):
+        hop = self.nxt_addr[row]
+        return ForwardingTable.FTabEntry(
+                    IPv4Address(self.net_prfx[row]),
+                    IPv4Address(PrefixTrie.MASKS[self.net_plen[row]]),
+                    IPv4Address(hop) if hop else None,
+                    self.ports[self.nxt_port[row]],
+                    self.status[row] == ForwardingTable.ROW_LOCAL
+        )
+
+    '''
+    entries
+    Iterates over all routes in the table as FTabEntry objects
+    '''
+    def entries(self):
+        for row in range(len(self.status)):
+            if self.status[row] != ForwardingTable.ROW_FREE:
+                yield self.entry(row)
+
+    def new_row(self, prefix, plen, hop, port_id, status):
+        if self.free_rows:
+            row = self.free_rows.pop()
+            self.net_prfx[row] = prefix
+            self.net_plen[row] = plen
+            self.nxt_addr[row] = hop
+            self.nxt_port[row] = port_id
+            self.status[row]   = status
+            self.hits[row]     = 0
+        else:
+            self.net_prfx.append(prefix)
+            self.net_plen.append(plen)
+            self.nxt_addr.append(hop)
+            self.nxt_port.append(port_id)
+            self.status.append(status)
+            self.hits.append(0)
+            row = len(self.status) - 1
+
+        self.ref_next_hop(row, 1)
+        return row
+
+    def remove_row(self, row):
+        self.generation += 1
+        self.ref_next_hop(row, -1)
+        self.policy.remove(row)
+        self.trie.remove(self.net_prfx[row], self.net_plen[row])
+        if self.dir24 is not None: self.dir24.remove(self.net_prfx[row], self.net_plen[row], row)
+        self.status[row] = ForwardingTable.ROW_FREE
+        self.free_rows.append(row)
+
+    #Counts a non-local row in or out of the next hops it uses
+    def ref_next_hop(self, row, delta):
+        hop = self.nxt_addr[row]
+        if self.status[row] != ForwardingTable.ROW_REMOTE or not hop: return
+
+        ports   = self.hop_refs.setdefault(hop, {})
+        port_id = self.nxt_port[row]
+        count   = ports.get(port_id, 0) + delta
+        if count > 0:
+            ports[port_id] = count
+        else:
+            ports.pop(port_id, None)
+            if not ports: del self.hop_refs[hop]
+
+    '''
+    next_hops
+    Returns the set of (next hop IPv4Address, port EthAddr) used by non-local routes
+    '''
+    def next_hops(self):
+        return set((IPv4Address(hop), self.ports[port_id])
+                        for hop, ports in self.hop_refs.items() for port_id in ports)
+
+    '''
+    next_hop_port
+    Returns the port a non-local route reaches a next hop through, or None once
+    no route in the table uses it
+      addr      Next hop IPv4Address
+    '''
+    def next_hop_port(self, addr):
+        ports = self.hop_refs.get(int(addr))
+        return self.ports[next(iter(ports))] if ports else None
+
+    '''
+    memory_usage
+    Returns the number of bytes held by the route columns and lookup structures
+    '''
+    def memory_usage(self):
+        columns = (self.net_prfx, self.net_plen, self.nxt_addr, self.nxt_port, self.status, self.hits)
+        usage   = sum(col.itemsize * len(col) for col in columns) + self.trie.memory_usage()
+        if self.dir24 is not None: usage += self.dir24.memory_usage()
+        return usage
+
+    def get_port_id(self, port):
+        port_id = self.port_ids.get(port)
+        if port_id is None:
+            port_id = len(self.ports)
+            self.ports.append(port)
+            self.port_ids[port] = port_id
+        return port_id
+
+    '''
+    lookup_routes
+    Finds routes for a batch of destinations at once using NumPy prefix arrays.
+    Each prefix length is checked with one vectorized binary search, longest first,
+    so a batch costs at most 33 passes regardless of its size
+    Parameters:
+        dsts        - array-like of destination addresses (ints, IPv4Address or strings)
+    Returns a NumPy array holding, per destination, the row of the matching route
+    (see entry), or -1 if no route was found
+    '''
+    def lookup_routes(self, dsts):
+        if np is None:
+            raise RuntimeError("lookup_routes requires numpy")
+
+        if self.batch_generation != self.generation:
+            self.build_batch_arrays()
+
+        dsts    = ForwardingTable.to_addr_array(dsts)
+        result  = np.full(len(dsts), -1, dtype=np.int64)
+        pending = np.arange(len(dsts))
+
+        for mask, prefixes, indexes in self.batch_levels:
+            if pending.size == 0: break
+
+            masked = dsts[pending] & mask
+            pos    = np.minimum(np.searchsorted(prefixes, masked), len(prefixes) - 1)
+            hit    = prefixes[pos] == masked
+
+            result[pending[hit]] = indexes[pos[hit]]
+            pending = pending[~hit]
+
+        return result
+
+    '''
+    build_batch_arrays
+    Builds prefix/mask/prefixlen arrays from the route columns, grouped by prefix
+    length (longest first) with each group's prefixes sorted for binary search
+    '''
+    def build_batch_arrays(self):
+        rows   = np.nonzero(np.frombuffer(self.status, dtype=np.uint8) != ForwardingTable.ROW_FREE)[0]
+        prefix = np.frombuffer(self.net_prfx, dtype=np.uint32)[rows]
+        plen   = np.frombuffer(self.net_plen, dtype=np.uint8)[rows]
+        mask   = np.array(PrefixTrie.MASKS, dtype=np.uint32)[plen]
+
+        levels = []
+        for length in sorted(set(plen.tolist()), reverse=True):
+            sel   = np.nonzero(plen == length)[0]
+            order = np.argsort(prefix[sel], kind='stable')
+            levels.append((mask[sel[0]], prefix[sel][order], rows[sel][order]))
+
+        self.batch_levels     = levels
+        self.batch_generation = self.generation
+
+    @staticmethod
+    def to_addr_array(dsts):
+        if isinstance(dsts, np.ndarray) and dsts.dtype.kind in 'iu':
+            return dsts.astype(np.uint32, copy=False)
+        return np.array([int(IPv4Address(x)) for x in dsts], dtype=np.uint32)
+
     '''
     load_file
-    Loads a file of forwarding table information
+    Loads a file of forwarding table information. If a compiled copy of the file
+    (see compile_file) exists and is up to date, it is loaded instead; if that
+    copy cannot be loaded, the text file is read
     Parameters:
         filename    - name of the file to load
+        strict      - True => a malformed line fails the load instead of being
+                      skipped (see read_routes)
+    Returns True if the table was loaded, False otherwise. A failed text load
+    may leave the routes read before the failure in the table
     '''
-    def load_file(self, filename):
+    def load_file(self, filename, strict = False):
         log_debug("FT: Load: {}".format(filename))
 
-        try:          
-            fh = open(filename, 'r')
-            for line in fh.readlines():
-                line   = line.strip()
-                fields = line.split()
-                if (len(fields) != 4):  continue
-                network  = fields[0] + "/" + fields[1]
-                next_hop = IPv4Address(fields[2])
-                intf     = self._net_.interface_by_name(fields[3])
-                mac_addr = intf.ethaddr
-
-                self.add_entry(network, next_hop, mac_addr, False)
-                fh.close()
+        compiled = ForwardingTable.compiled_name(filename)
+        try:
+            if os.path.getmtime(compiled) >= os.path.getmtime(filename):
+                if self.load_compiled(compiled): return True
+                log_info("Compiled table {} is unusable, reading {}".format(compiled, filename))
+        except OSError:
+            pass
+
+        ports = {}
+        try:
+            for prefix, plen, hop, name in ForwardingTable.read_routes(filename, strict):
+                if name not in ports:
+                    ports[name] = self.get_port_id(self._net_.interface_by_name(name).ethaddr)
+
+                self.add_route(prefix, plen, hop, ports[name], False)
+        except:
+            log_info("Failed to load table file {}: {}".format(filename, sys.exc_info()))
+            return False
+
+        return True
+
+    '''
+    load_compiled
+    Loads a compiled forwarding table by memory-mapping it and unpacking the
+    fixed-size records straight into the route columns. The header, file size,
+    interface names and every record are checked before any route is added, so
+    a truncated or corrupt file leaves the table untouched
+    Parameters:
+        filename    - name of the compiled file to load
+    Returns True if the table was loaded, False otherwise
+    '''
+    def load_compiled(self, filename):
+        log_debug("FT: Load compiled: {}".format(filename))
+
+        try:
+            with open(filename, 'rb') as fh, mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                magic, n_names, n_records = ForwardingTable.HEADER.unpack_from(mm, 0)
+                if magic != ForwardingTable.MAGIC:
+                    raise ValueError("bad magic {}".format(magic))
+
+                size = (ForwardingTable.HEADER.size + n_names * ForwardingTable.NAME.size +
+                        n_records * ForwardingTable.RECORD.size)
+                if len(mm) != size:
+                    raise ValueError("expected {} bytes, file has {}".format(size, len(mm)))
+
+                offset = ForwardingTable.HEADER.size
+                ports  = []
+                for i in range(n_names):
+                    name = ForwardingTable.NAME.unpack_from(mm, offset)[0].rstrip(b'\0').decode()
+                    ports.append(self.get_port_id(self._net_.interface_by_name(name).ethaddr))
+                    offset += ForwardingTable.NAME.size
+
+                #Check every record before the first route goes in
+                record = ForwardingTable.RECORD
+                with memoryview(mm) as view, view[offset:] as records:
+                    for i, (prefix, plen, name_id, hop) in enumerate(record.iter_unpack(records)):
+                        if plen > 32 or prefix & ~PrefixTrie.MASKS[plen] or name_id >= n_names:
+                            raise ValueError("bad record {}: {}/{} name {}".format(i, prefix, plen, name_id))
+
+                    for prefix, plen, name_id, hop in record.iter_unpack(records):
+                        self.add_route(prefix, plen, hop, ports[name_id], False)
         except:
-            log_debug("Failed to load table file {}: {}".format(filename, sys.exc_info()))
+            log_debug("Failed to load compiled table {}: {}".format(filename, sys.exc_info()))
+            return False
+
+        return True
+
+    '''
+    compile_file
+    Compiles a text forwarding table into the fixed-record binary format:
+        header      - magic, interface name count, record count
+        names       - interface names, 16 bytes each, NUL padded
+        records     - prefix, prefix length, name index, next hop (12 bytes each)
+    The file is written under a temporary name and renamed into place, so a
+    router watching <dst> never reads it half-written
+    Parameters:
+        src         - text forwarding table to read
+        dst         - compiled file to write (defaults to compiled_name(src))
+    Returns the number of routes written
+    Raises ValueError if an interface name does not fit in a name record
+    '''
+    @staticmethod
+    def compile_file(src, dst = None):
+        if dst is None: dst = ForwardingTable.compiled_name(src)
+
+        names   = {}
+        records = bytearray()
+        for prefix, plen, hop, name in ForwardingTable.read_routes(src):
+            if name not in names:
+                if len(name.encode()) > ForwardingTable.NAME.size:
+                    raise ValueError("Interface name longer than {} bytes: {}".format(ForwardingTable.NAME.size, name))
+                names[name] = len(names)
+            records += ForwardingTable.RECORD.pack(prefix, plen, names[name], hop)
+
+        count = len(records) // ForwardingTable.RECORD.size
+        tmp   = dst + ".tmp"
+        try:
+            with open(tmp, 'wb') as fh:
+                fh.write(ForwardingTable.HEADER.pack(ForwardingTable.MAGIC, len(names), count))
+                for name in names:
+                    fh.write(ForwardingTable.NAME.pack(name.encode()))
+                fh.write(records)
+            os.replace(tmp, dst)
+        except:
+            if os.path.exists(tmp): os.remove(tmp)
+            raise
+
+        return count
+
+    '''
+    read_routes
+    Streams routes out of a text forwarding table one line at a time, so very
+    large files are never held in memory. Blank lines are ignored; other
+    malformed lines are skipped
+    Parameters:
+        filename    - name of the file to read
+        strict      - True => raise ValueError on a malformed line instead, e.g.
+                      to catch a file that is still being written
+    Yields (prefix, prefix length, next hop, interface name) with integer addresses
+    '''
+    @staticmethod
+    def read_routes(filename, strict = False):
+        with open(filename, 'r') as fh:
+            for line in fh:
+                fields = line.split()
+                if not fields: continue
+
+                try:
+                    if (len(fields) != 4):  raise ValueError("expected 4 fields")
+                    prefix = int(IPv4Address(fields[0]))
+                    mask   = int(IPv4Address(fields[1]))
+                    hop    = int(IPv4Address(fields[2]))
+
+                    plen = 32 - ((~mask) & 0xFFFFFFFF).bit_length()
+                    if PrefixTrie.MASKS[plen] != mask or prefix & ~mask:
+                        raise ValueError("bad network")
+                except ValueError:
+                    if strict: raise ValueError("Bad table line: {}".format(line.strip()))
+                    log_debug("Skipping bad table line: {}".format(line.strip()))
+                    continue
+
+                yield prefix, plen, hop, fields[3]
+
+    @staticmethod
+    def compiled_name(filename):
+        return os.path.splitext(filename)[0] + ".bin"
 
     '''
     Class:          FTabEntry
-    Description:    Entry in the forwarding table
+    Description:    Entry in the forwarding table, built from a row on demand
     '''
     class FTabEntry:
+        __slots__ = ('net_prfx', 'net_mask', 'nxt_addr', 'nxt_port', 'is_local')
+
         def __init__(
                 self,
                 net_prfx: IPv4Address,
@@ -156,27 +1121,105 @@ class ForwardingTable:
             self.is_local = is_local
 #end class ForwardingTable
 
+'''
+Class:          TimerWheel
+Description:    Hashed timer wheel. Keys are hashed into <slots> buckets by the tick
+                their deadline falls in; advancing the wheel only visits the buckets
+                of the ticks that have passed, so expiry is O(1) amortized per key.
+                A bucket can hold keys due on a later lap, and keys whose deadline
+                moved, so callers re-check each key returned by advance and
+                reschedule it if it is not due yet
+'''
+class TimerWheel:
+    def __init__(self, tick = 1.0, slots = 64, now = None):
+        if now is None: now = time.time()
+        self.tick    = tick
+        self.slots   = [set() for i in range(slots)]
+        self.current = int(now / tick)
+
+    '''
+    schedule
+    Adds a key to the bucket of the tick its deadline falls in
+      key       Key to schedule
+      deadline  Time at which the key is due
+    '''
+    def schedule(self, key, deadline):
+        tick = max(-int(-deadline // self.tick), self.current + 1)
+        self.slots[tick % len(self.slots)].add(key)
+
+    '''
+    advance
+    Moves the wheel up to <now>
+    Returns the keys from every bucket passed over
+    '''
+    def advance(self, now = None):
+        if now is None: now = time.time()
+        target = int(now / self.tick)
+        if target <= self.current: return []
+
+        #After a long gap every bucket is visited once
+        ticks = min(target - self.current, len(self.slots))
+        keys  = []
+        for tick in range(target - ticks + 1, target + 1):
+            index = tick % len(self.slots)
+            if self.slots[index]:
+                keys.extend(self.slots[index])
+                self.slots[index] = set()
+
+        self.current = target
+        return keys
+#end class TimerWheel
+
 '''
 Class:          ARPContext
 Description:    Implements basic ARP functions, including IP to MAC translation and table management
                 ARP Context is iterable and supports direct get/set of IPv4 -> MAC mapping
+                Optional cache management:
+                    ttl            - entries expire <ttl> seconds after being learned (None => never)
+                    refresh_on_use - lookups restart an entry's ttl
+                    capacity       - maximum number of entries, least recently used evicted first
 '''
 class ARPContext:
-    def __init__(self):
-        self.map   = {}
+    def __init__(self, ttl = None, refresh_on_use = False, capacity = None):
+        self.map            = OrderedDict()
+        self.ttl            = ttl
+        self.refresh_on_use = refresh_on_use
+        self.capacity       = capacity
+        self.wheel          = TimerWheel() if ttl is not None else None
+        self.templates      = {}                #Local IP -> FrameTemplates
 
     def __iter__(self):
         return iter(self.map)
 
+    def __contains__(self, item):
+        return item in self.map
+
+    def __len__(self):
+        return len(self.map)
+
     def __getitem__(self, item):
-        if item in self.map and isinstance(self.map[item], ARPContext.ARPEntry):
-            return self.map[item].mac_addr
-        else:
-            return None
+        entry = self.map.get(item)
+        if not isinstance(entry, ARPContext.ARPEntry): return None
+
+        if self.capacity is not None:
+            self.map.move_to_end(item)
+        if self.refresh_on_use:
+            entry.timestamp = time.time()
+
+        return entry.mac_addr
 
     def __setitem__(self, ip_addr, mac_addr):
         self.add_mapping(ip_addr, mac_addr)
 
+    '''
+    remove_mapping
+    Removes the mapping (and frame templates) of an IP address, if any
+      ip_addr      IPv4Address
+    '''
+    def remove_mapping(self, ip_addr):
+        self.map.pop(ip_addr, None)
+        self.templates.pop(ip_addr, None)
+
     '''
     add_mapping
     Add or updates an IP to MAC address mapping
@@ -185,7 +1228,39 @@ class ARPContext:
     '''
     def add_mapping(self, ip_addr, mac_addr):
         if isinstance(ip_addr, IPv4Address) and isinstance(mac_addr, EthAddr):
-            self.map[ip_addr] = ARPContext.ARPEntry(mac_addr)
+            entry = ARPContext.ARPEntry(mac_addr)
+            self.map[ip_addr] = entry
+            self.templates.pop(ip_addr, None)
+            self.map.move_to_end(ip_addr)
+
+            if self.capacity is not None and len(self.map) > self.capacity:
+                self.map.popitem(last=False)
+            if self.wheel is not None:
+                self.wheel.schedule(ip_addr, entry.timestamp + self.ttl)
+
+    '''
+    expire
+    Removes entries whose ttl has run out. Called from the router loop
+      now          Current time (defaults to time.time())
+    Returns the list of IP addresses removed
+    '''
+    def expire(self, now = None):
+        if self.wheel is None: return []
+        if now is None: now = time.time()
+
+        removed = []
+        for ip_addr in self.wheel.advance(now):
+            entry = self.map.get(ip_addr)
+            if entry is None: continue
+
+            deadline = entry.timestamp + self.ttl
+            if deadline <= now:
+                del self.map[ip_addr]
+                removed.append(ip_addr)
+            else:
+                self.wheel.schedule(ip_addr, deadline)
+
+        return removed
 
     '''
     handle_arp_request
@@ -195,25 +1270,39 @@ class ARPContext:
     Returns an ARP reply packet
     '''
     def handle_arp_request(self, arp_head: Arp):
-        reply_ip  = arp_head.targetprotoaddr
-        reply_mac = self.map[reply_ip].mac_addr
-
-        #Construct reply packet
-        etp = Ethernet(
-                    ethertype = EtherType.ARP,
-                    src       = reply_mac,
-                    dst       = arp_head.senderhwaddr
-        )
+        templates = self.get_templates(arp_head.targetprotoaddr)
 
-        arp = Arp(
-                operation       = ArpOperation.Reply,
-                senderhwaddr    = reply_mac,
-                senderprotoaddr = reply_ip,
-                targethwaddr    = arp_head.senderhwaddr,
-                targetprotoaddr = arp_head.senderprotoaddr
-        )
+        #Patch the target fields of the prebuilt reply
+        etp = copy.copy(templates.reply_eth)
+        etp.dst = arp_head.senderhwaddr
 
-        return_pkt = etp + arp
+        arp = copy.copy(templates.reply_arp)
+        arp.targethwaddr    = arp_head.senderhwaddr
+        arp.targetprotoaddr = arp_head.senderprotoaddr
+
+        return_pkt = Packet()
+        return_pkt.add_header(etp)
+        return_pkt.add_header(arp)
+        return return_pkt
+
+    '''
+    reply_frame
+    Raw-bytes version of handle_arp_request. The reply is a copy of the prebuilt
+    frame with the destination and target fields overwritten, carried as a single
+    raw payload instead of Ethernet and Arp header objects
+       arp_head         Arp packet header to process
+    Returns an ARP reply packet
+    '''
+    def reply_frame(self, arp_head: Arp):
+        frame    = bytearray(self.get_templates(arp_head.targetprotoaddr).reply_raw)
+        mac_addr = arp_head.senderhwaddr.raw
+
+        frame[0:6]   = mac_addr
+        frame[32:38] = mac_addr
+        frame[38:42] = arp_head.senderprotoaddr.packed
+
+        return_pkt = Packet()
+        return_pkt.add_header(bytes(frame))
         return return_pkt
 
     '''
@@ -232,23 +1321,66 @@ class ARPContext:
     Returns a new Arp reqeust packet
     '''
     def get_arp_request(self, target_addr: IPv4, intf: Interface):
+        templates = self.templates.get(intf.ipaddr)
+        if templates is None or templates.mac_addr != intf.ethaddr:
+            templates = ARPContext.FrameTemplates(intf.ipaddr, intf.ethaddr)
+            self.templates[intf.ipaddr] = templates
 
-        arp_head = Arp(
-                    operation       = ArpOperation.Request,
-                    senderhwaddr    = intf.ethaddr,
-                    senderprotoaddr = intf.ipaddr,
-                    targetprotoaddr = target_addr
-        )
-
-        eth_head = Ethernet(
-                        ethertype = EtherType.ARP,
-                        src       = intf.ethaddr,
-                        dst       = SpecialEthAddr.ETHER_BROADCAST.value
-        )
+        arp_head = copy.copy(templates.request_arp)
+        arp_head.targetprotoaddr = target_addr
 
-        return_pkt = eth_head + arp_head
+        return_pkt = Packet()
+        return_pkt.add_header(copy.copy(templates.request_eth))
+        return_pkt.add_header(arp_head)
         return return_pkt
 
+    '''
+    get_templates
+    Returns the prebuilt frames of a local address, building them on first use
+      ip_addr           Local IPv4Address, must be in the table
+    '''
+    def get_templates(self, ip_addr):
+        templates = self.templates.get(ip_addr)
+        if templates is None:
+            templates = ARPContext.FrameTemplates(ip_addr, self.map[ip_addr].mac_addr)
+            self.templates[ip_addr] = templates
+        return templates
+
+    '''
+    Class:          ARPContext.FrameTemplates
+    Description:    ARP request and reply frames for one local address with the
+                    sender fields filled in. Only the target fields change per frame
+    '''
+    class FrameTemplates:
+        def __init__(self, ip_addr, mac_addr):
+            self.mac_addr    = mac_addr
+
+            self.request_eth = Ethernet(
+                                    ethertype = EtherType.ARP,
+                                    src       = mac_addr,
+                                    dst       = SpecialEthAddr.ETHER_BROADCAST.value
+            )
+            self.request_arp = Arp(
+                                    operation       = ArpOperation.Request,
+                                    senderhwaddr    = mac_addr,
+                                    senderprotoaddr = ip_addr,
+                                    targetprotoaddr = ip_addr
+            )
+
+            self.reply_eth   = Ethernet(
+                                    ethertype = EtherType.ARP,
+                                    src       = mac_addr,
+                                    dst       = mac_addr
+            )
+            self.reply_arp   = Arp(
+                                    operation       = ArpOperation.Reply,
+                                    senderhwaddr    = mac_addr,
+                                    senderprotoaddr = ip_addr,
+                                    targethwaddr    = mac_addr,
+                                    targetprotoaddr = ip_addr
+            )
+            self.reply_raw   = self.reply_eth.to_bytes() + self.reply_arp.to_bytes()
+
     '''
     Class:          ARPContext.ArpEntry
     Description:    Table entry pairing a timestamp with a MAC address
@@ -267,20 +1399,77 @@ Class:              Router
 Description:        Simulated IPv4 Router. Currently handles static packet forwarding and ARP lookup
 '''
 class Router(object):
-    def __init__(self, net: LLNetBase):
+    def __init__(self, net: LLNetBase, route_cache_size = 1024, route_capacity = 5, route_policy = "fifo", route_backend = "trie", route_compress = False,
+                 arp_ttl = 300, arp_refresh_on_use = False, arp_capacity = 4096, arp_prefetch_rate = 0,
+                 arp_holddown = 0, arp_holddown_capacity = 4096, queue_hop_packets = 256, queue_hop_bytes = 256*1024,
+                 queue_packets = 4096, queue_bytes = 4*1024*1024, queue_drop = "tail", arp_raw_replies = False,
+                 arp_snoop = "off", recv_batch = 1, ipv4_fast_path = False):
         self.net = net
         self.local_proto_eth = ARPContext()             #Local address maps
-        self.other_proto_eth = ARPContext()             #Other address maps
-        self.forwarding_table = ForwardingTable(net)    #Forwarding table
-
-        self.my_ips = [intf.ipaddr for intf in net.interfaces()]     #Local IPs
+        self.other_proto_eth = ARPContext(              #Other address maps
+                                    ttl            = arp_ttl,
+                                    refresh_on_use = arp_refresh_on_use,
+                                    capacity       = arp_capacity
+        )
+        self.arp_raw_replies = arp_raw_replies          #Answer ARP requests with raw frames (scenarios match header objects)
+        if arp_snoop not in ("off", "gratuitous", "all"):
+            raise ValueError("Unknown ARP snooping mode: {}".format(arp_snoop))
+        self.arp_snoop       = arp_snoop                #Learn senders of: requests to us and gratuitous ARPs, or every ARP
+        self.table_config = {                           #Forwarding table settings
+                                'size':       route_capacity,
+                                'cache_size': route_cache_size,
+                                'policy':     route_policy,
+                                'backend':    route_backend
+        }
+
+        #Interface index, filled in by index_interfaces
+        self.intf_by_name = {}                          #Interface name -> Interface
+        self.intf_by_mac  = {}                          #EthAddr -> Interface
+        self.my_ips       = set()                       #Local IPs as ints
+        self.intf_state   = None                        #(name, MAC, IP, netmask) of each indexed interface
+        self.index_interfaces()
 
         #Load context-provided forwarding table info
-        self.forwarding_table.load_file("forwarding_table.txt")
-
-        #Cache IP->MAC mapping for local interfaces
-        for intf in net.interfaces():
-            self.local_proto_eth[intf.ipaddr] = intf.ethaddr
+        self.table_file     = "forwarding_table.txt"
+        self.table_compress = route_compress
+        self.table_stamp    = self.get_table_stamp()
+        self.drm_routes     = {}                        #(prefix, plen) -> (next hop, port) learned from DRMs, replayed on reload
+        self.reload_thread  = None
+        self.reload_table   = None
+        self.forwarding_table = self.build_table()      #Forwarding table
+
+        #Proactive next hop resolution
+        self.prefetch_queue  = OrderedDict()            #Next hop IP -> port waiting for an ARP
+        self.prefetch_rate   = arp_prefetch_rate        #ARP requests per second (0 disables)
+        self.prefetch_tokens = float(arp_prefetch_rate)
+        self.prefetch_time   = time.time()
+
+        #Negative ARP cache
+        self.arp_holddown     = arp_holddown            #Seconds to drop traffic to a dead next hop (0 disables)
+        self.arp_failed       = {}                      #Next hop IP -> end of its hold-down
+        self.arp_failed_limit = arp_holddown_capacity   #Most entries kept in arp_failed
+        if arp_holddown_capacity is None or arp_holddown_capacity < 1:
+            raise ValueError("arp_holddown_capacity must be positive: {}".format(arp_holddown_capacity))
+
+        #Pending queue budgets
+        if queue_drop not in ("tail", "oldest"):
+            raise ValueError("Unknown queue drop policy: {}".format(queue_drop))
+        self.queue_hop_packets = queue_hop_packets      #Per next hop limits
+        self.queue_hop_bytes   = queue_hop_bytes
+        self.queue_packets     = queue_packets          #Limits across all next hops
+        self.queue_bytes       = queue_bytes
+        self.queue_drop        = queue_drop             #"tail" drops the new packet, "oldest" the oldest queued
+
+        self.drops = Counter()                          #Dropped packets by reason
+        self.recv_batch = recv_batch                    #Packets drained per loop iteration
+        self.ipv4_fast_path = ipv4_fast_path            #Forward plain IPv4 straight from the frame bytes
+        self.fast_forwarded = 0                         #Packets forwarded by the fast path
+
+        #Packet handlers by the ethertype of the first header
+        self.handlers = {}
+        self.register_handler(EtherType.ARP,  self.handle_arp)
+        self.register_handler(EtherType.IPv4, self.handle_ipv4)
+        self.register_handler(EtherType.SLOW, self.handle_DRM, DynamicRoutingMessage)
 
     #Main Router loop
     def router_main(self):
@@ -288,37 +1477,281 @@ class Router(object):
         Main method for router; we stay in a loop in this method, receiving
         packets until the end of time.
         '''
-        self.queue = []          #Packet waiting queue
-        self.index = {}          #Packet waiting index
+        TRACE.refresh()
+
+        self.pending     = {}    #Next hop IP -> PendingAddr waiting on ARP
+        self.deadlines   = []    #Min-heap of (deadline, seq, addr, PendingAddr) ARP retries/give-ups
+        self.deadline_id = 0     #Tie breaker for deadlines due at the same time
+        self.dwell       = Router.DwellStats()   #Time packets spent waiting on ARP
+        self.queued_packets = 0                  #Packets waiting across all next hops
+        self.queued_bytes   = 0                  #Bytes waiting across all next hops
+        self.queue_order    = deque()            #QueuedPackets in arrival order, for drop-oldest
+
+        #Resolve every next hop in the table before traffic needs it
+        self.queue_next_hops(self.forwarding_table)
 
         while True:
 
-            #Process any waiting packets
+            #Swap in a reloaded forwarding table once it is ready
+            if self.reload_thread is not None and not self.reload_thread.is_alive():
+                self.swap_table()
+
+            #Age out stale ARP entries, re-resolving expired next hops
+            for addr in self.other_proto_eth.expire():
+                port = self.forwarding_table.next_hop_port(addr)
+                if port is not None: self.queue_prefetch(addr, port)
+
+            #Process any waiting packets and background ARPs
             self.dequeue_packets()
+            self.send_prefetches()
 
             #Get and handle any new packets
             try:
-                _, input_port, pkt = self.net.recv_packet(timeout=1.0)
+                batch = [self.net.recv_packet(timeout=self.recv_timeout())]
             except NoPackets:
                 log_debug("No packets available in recv_packet")
+                self.check_table_file()
+                self.index_interfaces()
                 continue
             except Shutdown:
                 log_debug("Got shutdown signal")
+                self.log_stats()
                 break
 
-            log_debug("Got a packet: {}".format(str(pkt)))
-
-            if pkt.has_header(Arp):
-                self.handle_arp(pkt, input_port)
-            elif pkt.has_header(IPv4):
-                self.handle_ipv4(pkt)
-            elif pkt.has_header(DynamicRoutingMessage):
-                self.handle_DRM(pkt, input_port)
+            #Drain whatever else is ready without blocking
+            shutdown = False
+            while len(batch) < self.recv_batch:
+                try:
+                    batch.append(self.net.recv_packet(timeout=0))
+                except NoPackets:
+                    break
+                except Shutdown:
+                    shutdown = True
+                    break
+
+            if len(batch) == 1:
+                _, input_port, pkt = batch[0]
+                self.handle_packet(pkt, input_port)
             else:
-                log_debug("Packet is of unsupported format: {}".format(str(pkt)))
+                self.handle_batch(batch)
+
+            if shutdown:
+                log_debug("Got shutdown signal")
+                self.log_stats()
+                break
 
     #end Main Router loop
 
+    '''
+    register_handler
+    Registers the handler for packets whose Ethernet header carries an ethertype
+      ethertype     EtherType to dispatch on
+      handler       Callable taking (pkt, input_port)
+      header_class  Optional packet header class switchyard should parse the
+                    Ethernet payload into
+    '''
+    def register_handler(self, ethertype, handler, header_class = None):
+        if header_class is not None:
+            Ethernet.add_next_header_class(ethertype, header_class)
+        self.handlers[ethertype] = handler
+
+    '''
+    handle_packet
+    Dispatches a received packet to the handler of its ethertype
+      pkt           Packet to handle
+      input_port    port the packet arrived from
+    '''
+    def handle_packet(self, pkt: Packet, input_port):
+        TRACE.next_packet()
+        TRACE.trace("Got a packet: {}", pkt)
+
+        if self.ipv4_fast_path and self.forward_fast(pkt): return
+
+        handler = self.handlers.get(pkt[0].ethertype)
+        if handler is not None:
+            handler(pkt, input_port)
+        else:
+            TRACE.trace("Packet is of unsupported format: {}", pkt)
+
+    '''
+    handle_batch
+    Handles packets drained in one loop iteration. ARP frames are handled first so
+    replies in the batch resolve next hops before the IPv4 packets are forwarded;
+    IPv4 packets are routed with one table lookup per distinct destination. Other
+    handlers (DRMs) stay in order with the IPv4 packets around them. A destination
+    with IPv4 packets waiting in the batch skips the fast path, so a flow is never
+    reordered
+      batch         List of (timestamp, input port, packet) from recv_packet
+    '''
+    def handle_batch(self, batch):
+        TRACE.next_packet()                             #Trace sampling picks whole batches
+        ipv4     = []
+        deferred = set()                                #Destinations (int) of the packets in ipv4
+        for _, input_port, pkt in batch:
+            TRACE.trace("Got a packet: {}", pkt)
+            if self.ipv4_fast_path and self.forward_fast(pkt, deferred): continue
+
+            handler = self.handlers.get(pkt[0].ethertype)
+            if handler is None:
+                TRACE.trace("Packet is of unsupported format: {}", pkt)
+            elif handler == self.handle_ipv4:
+                ip_head = pkt.get_header(IPv4)
+                if isinstance(ip_head, IPv4): deferred.add(int(ip_head.dst))
+                ipv4.append(pkt)
+            elif handler == self.handle_arp:
+                handler(pkt, input_port)
+            else:
+                self.handle_ipv4_batch(ipv4)            #Route earlier packets first (e.g. before a DRM)
+                ipv4     = []
+                deferred = set()
+                handler(pkt, input_port)
+
+        self.handle_ipv4_batch(ipv4)
+
+    '''
+    log_stats
+    Logs the route cache, ARP queue and drop counters at shutdown
+    '''
+    def log_stats(self):
+        cache = self.forwarding_table.cache
+        if cache is not None:
+            log_info("Route cache: {} hits, {} misses, {} entries".format(cache.hits, cache.misses, len(cache)))
+        log_info("ARP queue dwell: {}".format(self.dwell))
+        log_info("Dropped packets: {}".format(dict(self.drops)))
+        if self.ipv4_fast_path:
+            log_info("Fast path forwarded: {} packets".format(self.fast_forwarded))
+
+    '''
+    index_interfaces
+    (Re)builds the interface lookups by name and MAC, the local IP set and the
+    local address maps if net.interfaces() changed since the last build.
+    Runs at startup, when the router is idle and when a lookup misses
+    '''
+    def index_interfaces(self):
+        interfaces = list(self.net.interfaces())
+        state      = tuple((intf.name, intf.ethaddr, intf.ipaddr, intf.netmask) for intf in interfaces)
+        if state == self.intf_state: return
+        self.intf_state = state
+        local_ips = set(intf.ipaddr for intf in interfaces)
+
+        #Dicts are updated in place so references to them stay valid
+        for index in (self.intf_by_name, self.intf_by_mac):
+            index.clear()
+        self.my_ips.clear()
+
+        for ip_addr in list(self.local_proto_eth):
+            if ip_addr not in local_ips: self.local_proto_eth.remove_mapping(ip_addr)
+
+        for intf in interfaces:
+            self.intf_by_name[intf.name]   = intf
+            self.intf_by_mac[intf.ethaddr] = intf
+            self.my_ips.add(int(intf.ipaddr))
+
+            #Cache IP->MAC mapping for local interfaces
+            if self.local_proto_eth[intf.ipaddr] != intf.ethaddr:
+                self.local_proto_eth[intf.ipaddr] = intf.ethaddr
+
+    '''
+    interface_by_name / interface_by_mac
+    Looks an interface up in the index, re-indexing once on a miss if the
+    interfaces changed
+    Returns the Interface, or None if there is no such interface
+    '''
+    def interface_by_name(self, name):
+        intf = self.intf_by_name.get(name)
+        if intf is None:
+            self.index_interfaces()
+            intf = self.intf_by_name.get(name)
+        return intf
+
+    def interface_by_mac(self, mac_addr):
+        intf = self.intf_by_mac.get(mac_addr)
+        if intf is None:
+            self.index_interfaces()
+            intf = self.intf_by_mac.get(mac_addr)
+        return intf
+
+    '''
+    build_table
+    Builds a new forwarding table from the interfaces and the table file
+      strict    True => fail if the table file cannot be loaded in full
+    Returns the new ForwardingTable, or None if strict and the load failed
+    '''
+    def build_table(self, strict = False):
+        table = ForwardingTable(self.net, **self.table_config)
+        if not table.load_file(self.table_file, strict) and strict: return None
+        if self.table_compress:
+            log_info("Compressed forwarding table from {} to {} routes".format(*table.compress()))
+        log_info("Forwarding table: {} routes, {} bytes".format(len(table), table.memory_usage()))
+        return table
+
+    '''
+    check_table_file
+    Starts rebuilding the forwarding table in the background if the table file
+    (or its compiled copy) changed. Called when recv_packet times out
+    '''
+    def check_table_file(self):
+        if self.reload_thread is not None: return
+
+        stamp = self.get_table_stamp()
+        if stamp == self.table_stamp: return
+
+        log_info("Forwarding table file changed, reloading")
+        self.table_stamp   = stamp
+        self.reload_thread = threading.Thread(target=self.reload_worker, daemon=True)
+        self.reload_thread.start()
+
+    '''
+    reload_worker
+    Builds the new forwarding table on the reload thread. A table file that is
+    missing, half-written or corrupt is not swapped in: the current table stays
+    until the file changes again
+    '''
+    def reload_worker(self):
+        try:
+            self.reload_table = self.build_table(strict = True)
+        except:
+            log_info("Failed to reload forwarding table: {}".format(sys.exc_info()))
+
+        if self.reload_table is None:
+            log_info("Keeping the current forwarding table")
+
+    '''
+    swap_table
+    Replaces the forwarding table with the one built by the reload thread.
+    DRM-learned routes still in the current table are replayed first, in the
+    current eviction order; ARP state and queued packets are untouched
+    '''
+    def swap_table(self):
+        table = self.reload_table
+        self.reload_thread = None
+        self.reload_table  = None
+        if table is None: return
+
+        live   = self.forwarding_table
+        routes = {}
+        for row in live.policy.order():
+            key   = (live.net_prfx[row], live.net_plen[row])
+            route = self.drm_routes.get(key)
+            if route is None: continue
+
+            next_hop, port = routes[key] = route
+            table.add_route(key[0], key[1], int(next_hop), table.get_port_id(port), False)
+        self.drm_routes = routes
+
+        self.forwarding_table = table
+        self.queue_next_hops(table)
+
+    #Modification times of the table file and its compiled copy (None if missing)
+    def get_table_stamp(self):
+        stamp = []
+        for filename in (self.table_file, ForwardingTable.compiled_name(self.table_file)):
+            try:
+                stamp.append(os.stat(filename).st_mtime_ns)
+            except OSError:
+                stamp.append(None)
+        return tuple(stamp)
+
     '''
     handle_DRM
     Handles a Dynamic Routing Message in a packet (if one exists)
@@ -329,33 +1762,79 @@ class Router(object):
     def handle_DRM(self, pkt: Packet, input_port):
         drm_head = pkt.get_header(DynamicRoutingMessage)
         if not isinstance(drm_head, DynamicRoutingMessage): return
-        log_debug("R: Handle DRM: {}".format(pkt))
+        TRACE.trace("R: Handle DRM: {}", pkt)
 
         #Add/Update the route
-        network = "{}/{}".format(drm_head.advertised_prefix, drm_head.advertised_mask)
-        port_intf = self.net.interface_by_name(input_port)
-
+        network = IPv4Network("{}/{}".format(drm_head.advertised_prefix, drm_head.advertised_mask))
+        port_intf = self.interface_by_name(input_port)
         self.forwarding_table.add_entry(network, drm_head.next_hop, port_intf.ethaddr, False)
 
+        #Remember it for reloads, newest last. Routes the table has evicted are
+        #dropped once the record grows past twice the table capacity
+        key = (int(network.network_address), network.prefixlen)
+        self.drm_routes.pop(key, None)
+        self.drm_routes[key] = (drm_head.next_hop, port_intf.ethaddr)
+        if len(self.drm_routes) > 2 * self.forwarding_table.size:
+            trie = self.forwarding_table.trie
+            self.drm_routes = {k: v for k, v in self.drm_routes.items() if trie.find(*k) is not None}
+
+        #Resolve the new next hop in the background
+        self.queue_prefetch(drm_head.next_hop, port_intf.ethaddr)
+
     '''
     handle_ipv4
     Handles an IPv4 header in the packet (if one exists)
     Attempts to forward the packet based on the existing routing table
     Requests MAC addresses using ARP if necessary
-      pkt       Packet to handle
+      pkt           Packet to handle
+      input_port    port the packet arrived from (unused)
     '''
-    def handle_ipv4(self, pkt: Packet):
+    def handle_ipv4(self, pkt: Packet, input_port = None):
 
         ip_head = pkt.get_header(IPv4)
         if not isinstance(ip_head, IPv4): return
-        log_debug("R: Handle IPv4: {}".format(pkt))
+        TRACE.trace("R: Handle IPv4: {}", pkt)
 
         #Drop packet if this port is its destination
-        if ip_head.dst in self.my_ips: return
+        if int(ip_head.dst) in self.my_ips: return
+
+        #Lookup forwarding info
+        self.route_ipv4(pkt, self.forwarding_table.lookup_route(ip_head))
+
+    '''
+    handle_ipv4_batch
+    Handles IPv4 packets drained in one batch, looking each destination up once
+      pkts      List of IPv4 Packets (others are skipped)
+    '''
+    def handle_ipv4_batch(self, pkts):
+        routes = {}
+        lookup = self.forwarding_table.lookup_route
+
+        for pkt in pkts:
+            ip_head = pkt.get_header(IPv4)
+            if not isinstance(ip_head, IPv4): continue
+            TRACE.trace("R: Handle IPv4: {}", pkt)
+            if int(ip_head.dst) in self.my_ips: continue
+
+            route = routes.get(ip_head.dst, False)
+            if route is False:
+                route = routes[ip_head.dst] = lookup(ip_head)
+            self.route_ipv4(pkt, route)
+
+    '''
+    route_ipv4
+    Forwards an IPv4 packet along a looked up route. If no dest MAC is known,
+    sidetrack the packet and send ARP
+      pkt       Packet to forward
+      route     (port, next hop addr) from lookup_route, or None
+    '''
+    def route_ipv4(self, pkt: Packet, route):
+        if route is None:
+            self.drops['no_route'] += 1
+            return
 
-        #Lookup forwarding info. If no dest MAC is known, sidetrack and send ARP
-        port, addr = self.forwarding_table.lookup_route(ip_head)
-        log_debug("Type of Port: {}\nType of Addr: {}".format(type(port), type(addr)))
+        port, addr = route
+        TRACE.trace("Type of Port: {}\nType of Addr: {}", type(port), type(addr))
 
         if (isinstance(port, EthAddr) and isinstance(addr, IPv4Address)):
             if addr in self.other_proto_eth:
@@ -367,23 +1846,78 @@ class Router(object):
     '''
     forward_ipv4
     Forwards an IPv4 packet to a new destination through a specific port
-      pkt       Packet to forward (Ethernet header will be replaced)
+      pkt       Packet to forward (Ethernet header is rewritten)
       out_port  Output port
       dst_mac   Destination MAC
     '''
     def forward_ipv4(self, pkt: Packet, out_port: EthAddr, dst_mac: EthAddr):
 
-        #Create new Ethernet Header
-        del pkt[0]
-        eth_head = Ethernet(src=out_port, dst=dst_mac, ethertype=EtherType.IPv4)
-        pkt.prepend_header(eth_head)
+        #Rewrite the Ethernet header in place; anything but plain Ethernet + IPv4
+        #gets a new header
+        eth_head = pkt[0]
+        if isinstance(eth_head, Ethernet) and eth_head.ethertype == EtherType.IPv4:
+            eth_head.src = out_port
+            eth_head.dst = dst_mac
+        else:
+            del pkt[0]
+            eth_head = Ethernet(src=out_port, dst=dst_mac, ethertype=EtherType.IPv4)
+            pkt.prepend_header(eth_head)
 
         #Decrement TTL
         pkt[IPv4].ttl -= 1
 
-        out_interface = self.net.interface_by_macaddr(out_port)
+        out_interface = self.interface_by_mac(out_port)
         self.send_packet(pkt, out_interface.name)
 
+    '''
+    forward_fast
+    Forwards plain IPv4 unicast (no options, TTL > 1, resolved next hop) straight
+    from the bytes the packet was received as: the MACs and TTL are patched in a
+    copy of the frame and the header checksum is updated incrementally (RFC 1624)
+    instead of being recomputed. Anything else is left to the object path
+      pkt       Packet as received
+      deferred  Destinations (int) with earlier packets still on the object path;
+                these are left to it too, to keep their order
+    Returns True if the packet was forwarded
+    '''
+    def forward_fast(self, pkt: Packet, deferred = ()):
+        frame = getattr(pkt, '_raw', None)              #Bytes switchyard parsed the packet from
+        if not frame or len(frame) < 34: return False
+
+        view = memoryview(frame)
+        if view[12] != 0x08 or view[13] != 0x00 or view[14] != 0x45: return False
+
+        ttl = view[22]
+        dst = int.from_bytes(view[30:34], 'big')
+        if ttl <= 1 or dst in self.my_ips or dst >= 0xE0000000: return False     #Multicast/broadcast
+        if dst in deferred: return False
+
+        route = self.forwarding_table.lookup_addr(dst)
+        if route is None: return False
+        port, addr = route
+        dst_mac = self.other_proto_eth[addr]
+        if dst_mac is None: return False                #Unresolved: queued by the object path
+
+        out = bytearray(frame)
+        out[0:6]  = dst_mac.raw
+        out[6:12] = port.raw
+        out[22]   = ttl - 1
+
+        #HC' = ~(~HC + ~m + m'), m being the TTL/protocol word
+        old_word = (ttl << 8) | out[23]
+        total    = (~((out[24] << 8) | out[25]) & 0xFFFF) + (~old_word & 0xFFFF) + (old_word - 0x100)
+        total    = (total & 0xFFFF) + (total >> 16)
+        total    = (total & 0xFFFF) + (total >> 16)
+        checksum = ~total & 0xFFFF
+        out[24]  = checksum >> 8
+        out[25]  = checksum & 0xFF
+
+        fast_pkt = Packet()
+        fast_pkt.add_header(bytes(out))
+        self.send_packet(fast_pkt, self.interface_by_mac(port).name)
+        self.fast_forwarded += 1
+        return True
+
     '''
     handle_arp
     Handles an ARP header in the packet (if one exists)
@@ -399,14 +1933,54 @@ class Router(object):
 
         if arp_head.targetprotoaddr in self.local_proto_eth:
             if arp_head.operation == ArpOperation.Request:
-                self.send_packet(self.local_proto_eth.handle_arp_request(arp_head), input_port)
+                if self.arp_raw_replies:
+                    reply = self.local_proto_eth.reply_frame(arp_head)
+                else:
+                    reply = self.local_proto_eth.handle_arp_request(arp_head)
+                self.send_packet(reply, input_port)
+                if self.arp_snoop != "off": self.snoop_arp(arp_head, input_port)
                 return None
 
             elif arp_head.operation == ArpOperation.Reply:
-                return self.other_proto_eth.handle_arp_reply(arp_head)
+                self.other_proto_eth.handle_arp_reply(arp_head)
+                self.arp_resolved(arp_head.senderprotoaddr)
+                return None
 
             else:
-                log_debug("Unknown ARP header operation: {}".format(str(arp_head)))
+                TRACE.trace("Unknown ARP header operation: {}", arp_head)
+
+        elif self.arp_snoop == "all" or (self.arp_snoop == "gratuitous" and
+                                         arp_head.senderprotoaddr == arp_head.targetprotoaddr):
+            self.snoop_arp(arp_head, input_port)
+
+    '''
+    snoop_arp
+    Learns the sender of an ARP frame that was not a reply to us. Only senders on
+    the subnet of the receiving interface are learned; the entry ages like any other
+      arp_head      Arp packet header
+      input_port    port the packet arrived from
+    '''
+    def snoop_arp(self, arp_head: Arp, input_port):
+        sender = arp_head.senderprotoaddr
+        if int(sender) == 0 or sender in self.local_proto_eth: return     #ARP probe or one of ours
+
+        intf    = self.interface_by_name(input_port)
+        netmask = int(intf.netmask)
+        if int(sender) & netmask != int(intf.ipaddr) & netmask: return
+
+        self.other_proto_eth.add_mapping(sender, arp_head.senderhwaddr)
+        self.arp_resolved(sender)
+
+    '''
+    arp_resolved
+    Called when a mapping for addr was learned: lifts its hold-down and sends
+    whatever was waiting on it right away
+      addr          IPv4Address that was resolved
+    '''
+    def arp_resolved(self, addr: IPv4Address):
+        self.arp_failed.pop(addr, None)
+        if addr in self.pending:
+            self.flush_pending(addr)
 
     '''
     send_packet
@@ -419,87 +1993,280 @@ class Router(object):
             log_debug("send_packet called with invalid packet: {}".format(pkt))
             return
 
-        ports = [ intf.name for intf in self.net.interfaces() ]
-        if not output_port in ports:
+        if self.interface_by_name(output_port) is None:
             log_debug("send_packet called with unknown port: {}".format(output_port))
             return
 
-        log_debug("R: Send Packet: {} on {}".format(str(pkt), output_port))
+        TRACE.trace("R: Send Packet: {} on {}", pkt, output_port)
 
         try:
             self.net.send_packet(output_port, pkt)
         except ValueError as e:
             log_debug("Failed to send packet. Got ValueError: {}".format(e))
-        except:
-            log_debug("Failed to send packet. Unknown Error: {}".format(sys.exc_info()))
+        except PcapException as e:
+            log_debug("Failed to send packet. Got PcapException: {}".format(e))
 
     '''
     enqueue_packet
     Side-tracks a packet until its destination IP can be resolved to a MAC
-    Generates and sends an ARP requests, then places the packet on a queue
+    Places the packet on the queue for its next hop; the first packet for a
+    next hop makes an ARP request due right away
       pkt           Packet
       port          Output port
       addr          Destination IPv4 addr
     '''
     def enqueue_packet(self, pkt: Packet, port: EthAddr, addr: IPv4Address):
+        #Fast-drop traffic to a next hop that recently failed to resolve
+        held = self.arp_failed.get(addr)
+        if held is not None:
+            if time.time() < held:
+                self.drops['arp_holddown'] += 1
+                return
+            del self.arp_failed[addr]
+
+        pending = self.pending.get(addr)
+
+        #First packet for this next hop: ARP right away
+        if pending is None:
+            pending = Router.PendingAddr(port)
+            self.pending[addr] = pending
+            self.schedule_pending(addr, pending, time.time())
+
+        queued_pkt = Router.QueuedPacket(pkt, port, addr, size = pkt.size())
+        if not self.make_room(pending, queued_pkt.size): return
+
         #Enqueue the packet to be sent later
-        self.queue.append(Router.QueuedPacket(pkt, port, addr))
+        pending.packets.append(queued_pkt)
+        pending.bytes       += queued_pkt.size
+        self.queued_packets += 1
+        self.queued_bytes   += queued_pkt.size
+        if self.queue_drop == "oldest": self.queue_order.append(queued_pkt)
 
-        #Add to index if necessary
-        if addr not in self.index:
-            self.index[addr] = (0, time.time()-2)
+    '''
+    make_room
+    Applies the per next hop and global queue budgets before a packet is queued.
+    With drop-tail the new packet is refused; with drop-oldest the oldest packets
+    of the next hop, then of the whole queue, are dropped until it fits
+      pending       PendingAddr the packet is for
+      size          Size of the packet in bytes
+    Returns True if the packet can be queued
+    '''
+    def make_room(self, pending, size):
+        while (len(pending.packets) + 1 > self.queue_hop_packets or
+               pending.bytes + size > self.queue_hop_bytes):
+            if self.queue_drop == "tail" or not pending.packets:
+                self.drops['queue_hop_limit'] += 1
+                return False
+            self.unqueue(pending, pending.packets.popleft())
+            self.drops['queue_hop_limit'] += 1
+
+        while (self.queued_packets + 1 > self.queue_packets or
+               self.queued_bytes + size > self.queue_bytes):
+            if self.queue_drop == "tail" or not self.queue_order:
+                self.drops['queue_global_limit'] += 1
+                return False
+
+            #The oldest packet still queued is also the oldest of its next hop
+            oldest = self.queue_order.popleft()
+            if not oldest.queued: continue
+            owner = self.pending[oldest.addr]
+            self.unqueue(owner, owner.packets.popleft())
+            self.drops['queue_global_limit'] += 1
+
+        return True
+
+    '''
+    unqueue
+    Takes a packet out of the queue budgets once it is sent or dropped
+      pending       PendingAddr the packet was queued on
+      queued_pkt    QueuedPacket leaving the queue
+    '''
+    def unqueue(self, pending, queued_pkt):
+        queued_pkt.queued    = False
+        pending.bytes       -= queued_pkt.size
+        self.queued_packets -= 1
+        self.queued_bytes   -= queued_pkt.size
+
+        #Drop stale references once most of queue_order is stale
+        if len(self.queue_order) > 2 * self.queued_packets + 64:
+            self.queue_order = deque(q for q in self.queue_order if q.queued)
 
     '''
     dequeue_packets
-    Evaluates side-tracked packets. Sends packets with resolvable destinations.
-    For packets still waiting for destinations, sends up to 2 additional ARP requests
-    Drops packets after 3 ARP requests.
+    Evaluates side-tracked packets. Next hops resolved by an ARP reply are flushed
+    by handle_arp as soon as the reply arrives. Pops the ARP deadlines that are
+    due: unresolved next hops get up to 2 additional ARP requests, 1 second
+    apart, and their packets are dropped 1 second after the 3rd request.
+    Only due deadlines are visited; addresses still waiting are not touched
     '''
     def dequeue_packets(self):
+        if not self.pending:
+            self.deadlines.clear()
+            return
+
         now = time.time()
-        log_debug("Queue length: {}".format(len(self.queue)))
-        for queued_pkt in self.queue:
-            log_debug("Trying to dequeue: {}".format(queued_pkt))
-            addr = queued_pkt.addr
-            arps = self.index[addr][0]
-            last = self.index[addr][1]
-            if addr in self.other_proto_eth:
-                #Send packet
-                self.forward_ipv4(
-                            queued_pkt.packet,
-                            queued_pkt.port,
-                            self.other_proto_eth[addr]
-                )
+        while self.deadlines and self.deadlines[0][0] <= now:
+            deadline, _, addr, pending = heapq.heappop(self.deadlines)
 
-                self.queue.remove(queued_pkt)
+            #Skip deadlines of next hops flushed or rescheduled since
+            if self.pending.get(addr) is not pending or pending.deadline != deadline: continue
 
-            #Send another ARP if fewer than 3 ARPs have been sent and at least 1 second has passed
-            elif now-last < 1:
-                continue
-            elif arps < 3:
+            if addr in self.other_proto_eth:
+                self.flush_pending(addr)
 
-                out_interface = self.net.interface_by_macaddr(queued_pkt.port)
+            elif pending.arps < 3:
+                out_interface = self.interface_by_mac(pending.port)
                 arp_pkt = self.local_proto_eth.get_arp_request(addr, out_interface)
 
                 self.send_packet(arp_pkt, out_interface.name)
 
-                self.index[addr] = (arps+1, now)
+                pending.arps += 1
+                pending.last  = now
+                self.schedule_pending(addr, pending, now + 1)
 
             else:
                 #Give up
-                self.queue.remove(queued_pkt)
-                del self.index[addr]
+                log_debug("Dropping {} packets for unresolved {}".format(len(pending.packets), addr))
+                self.drops['arp_timeout'] += len(pending.packets)
+                for queued_pkt in pending.packets:
+                    self.unqueue(pending, queued_pkt)
+                del self.pending[addr]
+                if self.arp_holddown > 0: self.hold_down(addr, now)
+
+    '''
+    flush_pending
+    Forwards every packet waiting on a resolved next hop, recording how long
+    each one spent in the queue
+      addr          Next hop IPv4 addr
+    '''
+    def flush_pending(self, addr: IPv4Address):
+        pending = self.pending.pop(addr)
+        dst_mac = self.other_proto_eth[addr]
+        now     = time.time()
+        for queued_pkt in pending.packets:
+            self.unqueue(pending, queued_pkt)
+            self.dwell.record(now - queued_pkt.time)
+            self.forward_ipv4(queued_pkt.packet, queued_pkt.port, dst_mac)
+
+    '''
+    hold_down
+    Adds a next hop to the negative ARP cache for <arp_holddown> seconds.
+    Expired entries are purged in bulk when the cache reaches its limit; if
+    none have expired, the oldest entry makes room
+      addr          Next hop IPv4 addr
+      now           Current time
+    '''
+    def hold_down(self, addr: IPv4Address, now):
+        if len(self.arp_failed) >= self.arp_failed_limit:
+            self.arp_failed = {k: v for k, v in self.arp_failed.items() if v > now}
+            if len(self.arp_failed) >= self.arp_failed_limit:
+                del self.arp_failed[next(iter(self.arp_failed))]
+        self.arp_failed[addr] = now + self.arp_holddown
+
+    def schedule_pending(self, addr, pending, deadline):
+        pending.deadline  = deadline
+        self.deadline_id += 1
+        heapq.heappush(self.deadlines, (deadline, self.deadline_id, addr, pending))
+
+    '''
+    recv_timeout
+    Returns how long recv_packet may block: until the nearest ARP deadline,
+    and at most 1 second so idle-time housekeeping still runs
+    '''
+    def recv_timeout(self):
+        timeout = 1.0
+        if self.deadlines:
+            timeout = min(timeout, max(0.0, self.deadlines[0][0] - time.time()))
+        if self.prefetch_queue and self.prefetch_rate > 0:
+            timeout = min(timeout, max(0.0, (1 - self.prefetch_tokens) / self.prefetch_rate))
+        return timeout
+
+    '''
+    queue_next_hops
+    Queues a background ARP for every next hop in a forwarding table
+      table         ForwardingTable to take the next hops from
+    '''
+    def queue_next_hops(self, table: ForwardingTable):
+        for addr, port in table.next_hops():
+            self.queue_prefetch(addr, port)
+
+    '''
+    queue_prefetch
+    Queues a background ARP for a next hop unless it is resolved or already pending
+      addr          Next hop IPv4 addr
+      port          Port the next hop is reached through
+    '''
+    def queue_prefetch(self, addr: IPv4Address, port: EthAddr):
+        if self.prefetch_rate <= 0: return
+        if addr in self.other_proto_eth or addr in self.pending: return
+        self.prefetch_queue[addr] = port
+
+    '''
+    send_prefetches
+    Sends queued background ARPs, limited to <prefetch_rate> per second by a
+    token bucket. Replies are learned by handle_arp like any other
+    '''
+    def send_prefetches(self):
+        if not self.prefetch_queue: return
+
+        now = time.time()
+        self.prefetch_tokens = min(float(self.prefetch_rate),
+                                   self.prefetch_tokens + (now - self.prefetch_time) * self.prefetch_rate)
+        self.prefetch_time = now
+
+        while self.prefetch_queue and self.prefetch_tokens >= 1:
+            addr, port = self.prefetch_queue.popitem(last=False)
+            if addr in self.other_proto_eth or addr in self.pending: continue
+            if self.forwarding_table.next_hop_port(addr) is None: continue    #Route evicted since
+
+            out_interface = self.interface_by_mac(port)
+            self.send_packet(self.local_proto_eth.get_arp_request(addr, out_interface), out_interface.name)
+            self.prefetch_tokens -= 1
+
+    '''
+    Class:          DwellStats
+    Description:    Running count/mean/max of packet queue dwell times, in seconds
+    '''
+    class DwellStats:
+        def __init__(self):
+            self.count = 0
+            self.total = 0.0
+            self.max   = 0.0
+
+        def record(self, dwell):
+            self.count += 1
+            self.total += dwell
+            if dwell > self.max: self.max = dwell
+
+        def __str__(self):
+            mean = self.total / self.count if self.count else 0.0
+            return "{} packets, mean {:.6f}s, max {:.6f}s".format(self.count, mean, self.max)
+
+    '''
+    Class:          PendingAddr
+    Description:    ARP state and waiting packets for one unresolved next hop
+    '''
+    class PendingAddr:
+        def __init__(self, port: EthAddr):
+            self.port     = port             #Port the ARP requests go out on
+            self.arps     = 0                #ARP requests sent so far
+            self.last     = None             #Time of the last ARP request
+            self.deadline = None             #Time the next ARP retry or give-up is due
+            self.packets  = deque()          #QueuedPackets, oldest first
+            self.bytes    = 0                #Total size of the queued packets
 
     '''
     Class:          QueuedPacket
     Description:    Datastructure for tracking sidetracked packets
     '''
     class QueuedPacket:
-        def __init__(self, pkt: Packet, port: EthAddr, addr: IPv4Address, timestamp = None):
+        def __init__(self, pkt: Packet, port: EthAddr, addr: IPv4Address, timestamp = None, size = 0):
             self.packet = pkt
             self.addr   = addr
             self.port   = port
             self.arps   = 1
+            self.size   = size
+            self.queued = True
 
             if timestamp == None:
                 self.time = time.time()
@@ -508,11 +2275,34 @@ class Router(object):
 
 #end class Router
 
-def main(net):
+def main(net, **kwargs):
     '''
     Main entry point for router.  Just create Router
     object and get it going.
+    Router settings can be passed as switchyard code arguments, e.g.
+        swyard -t stage3_tests.py myrouter_part3.py -g "route_cache_size=0"
     '''
-    r = Router(net)
+    r = Router(net, **{name: parse_codearg(value) for name, value in kwargs.items()})
     r.router_main()
     net.shutdown()
+
+'''
+parse_codearg
+Converts a code argument string to a Python value ("30" => 30, "True" => True);
+anything that is not a literal (e.g. lru) stays a string
+'''
+def parse_codearg(value):
+    try:
+        return ast.literal_eval(value)
+    except (ValueError, SyntaxError):
+        return value
+
+'''
+Compiles a text forwarding table for faster router startup:
+    python3 myrouter_part3.py forwarding_table.txt [forwarding_table.bin]
+'''
+if __name__ == "__main__":
+    src = sys.argv[1] if len(sys.argv) > 1 else "forwarding_table.txt"
+    dst = sys.argv[2] if len(sys.argv) > 2 else None
+    count = ForwardingTable.compile_file(src, dst)
+    print("Compiled {} routes from {}".format(count, src))
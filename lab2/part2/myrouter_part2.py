@@ -12,6 +12,110 @@ from switchyard.lib.packet.util import *
 from switchyard.lib.userlib import *
 from switchyard.llnetbase import LLNetBase
 
+'''
+Class:          PrefixTrie
+Description:    Path-compressed binary (Patricia) trie for longest prefix matching
+                Prefixes and addresses are stored as 32-bit integers. Each node holds
+                the prefix bits it covers, the prefix length and an optional value.
+                Lookup cost depends on the prefix length, not on the number of routes
+'''
+class PrefixTrie:
+    def __init__(self):
+        self.root  = PrefixTrie.Node(0, 0)
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    '''
+    insert
+    Adds or replaces the value stored for a prefix
+      prefix    Network prefix as a 32-bit integer (host bits must be zero)
+      plen      Prefix length, 0-32
+      value     Value to store for the prefix
+    '''
+    def insert(self, prefix, plen, value):
+        node = self.root
+        while True:
+            if node.plen == plen:
+                if node.value is None: self.count += 1
+                node.value = value
+                return
+
+            bit   = PrefixTrie.bit_at(prefix, node.plen)
+            child = node.child[bit]
+
+            if child is None:
+                node.child[bit] = PrefixTrie.Node(prefix, plen, value)
+                self.count += 1
+                return
+
+            common = PrefixTrie.common_len(child.prefix, prefix, min(child.plen, plen))
+            if common == child.plen:
+                node = child
+                continue
+
+            #New prefix sits between node and child
+            if common == plen:
+                new_node = PrefixTrie.Node(prefix, plen, value)
+                new_node.child[PrefixTrie.bit_at(child.prefix, plen)] = child
+                node.child[bit] = new_node
+                self.count += 1
+                return
+
+            #Prefixes diverge below node; join them with a valueless glue node
+            glue = PrefixTrie.Node(prefix & PrefixTrie.mask(common), common)
+            glue.child[PrefixTrie.bit_at(child.prefix, common)] = child
+            glue.child[PrefixTrie.bit_at(prefix, common)] = PrefixTrie.Node(prefix, plen, value)
+            node.child[bit] = glue
+            self.count += 1
+            return
+
+    '''
+    lookup
+    Finds the value of the longest prefix containing an address
+      addr      IPv4 address as a 32-bit integer
+    Returns the stored value, or None if no prefix matches
+    '''
+    def lookup(self, addr):
+        best = None
+        node = self.root
+        while node is not None:
+            if (addr ^ node.prefix) & PrefixTrie.mask(node.plen): break
+            if node.value is not None: best = node.value
+            if node.plen == 32: break
+            node = node.child[(addr >> (31 - node.plen)) & 1]
+
+        return best
+
+    @staticmethod
+    def mask(plen):
+        return (0xFFFFFFFF << (32 - plen)) & 0xFFFFFFFF
+
+    @staticmethod
+    def bit_at(value, pos):
+        return (value >> (31 - pos)) & 1
+
+    @staticmethod
+    def common_len(a, b, limit):
+        diff = (a ^ b) & PrefixTrie.mask(limit)
+        if diff == 0: return limit
+        return 32 - diff.bit_length()
+
+    '''
+    Class:          PrefixTrie.Node
+    Description:    Trie node covering <plen> leading bits of <prefix>
+    '''
+    class Node:
+        __slots__ = ('prefix', 'plen', 'value', 'child')
+
+        def __init__(self, prefix, plen, value = None):
+            self.prefix = prefix
+            self.plen   = plen
+            self.value  = value
+            self.child  = [None, None]
+#end class PrefixTrie
+
 '''
 Class:          ForwardingTable
 Description:    Implements a basic forwarding table
@@ -25,6 +129,7 @@ class ForwardingTable:
     def __init__(self, net: LLNetBase):
         self._net_ = net
         self.table = {}
+        self.trie  = PrefixTrie()
 
         #Populate table based on net object
         for intf in net.interfaces():
@@ -47,12 +152,14 @@ class ForwardingTable:
         log_debug("FT: Add: {}, {}, {}".format(str(network), str(next_hop), str(port)))
 
         net_addr = IPv4Network(network)
-        self.table[net_addr] = ForwardingTable.FTabEntry(
+        entry = ForwardingTable.FTabEntry(
                                     net_addr.network_address,
                                     net_addr.netmask,
                                     next_hop,
                                     port
         )
+        self.table[net_addr] = entry
+        self.trie.insert(int(net_addr.network_address), net_addr.prefixlen, entry)
 
     '''
     lookup_route
@@ -63,19 +170,12 @@ class ForwardingTable:
     '''
     def lookup_route(self, ip_head: IPv4):
 
-        #Get matching networks, sorted by prefix length larget > small
-        networks = sorted(
-                        filter(
-                            lambda x: ip_head.dst in x,
-                            self.table.keys()
-                        ),
-                        key=lambda x: x.prefixlen,
-                        reverse=True
-        )
+        #Longest prefix match through the trie
+        entry = self.trie.lookup(int(ip_head.dst))
 
-        if len(networks) > 0:
-            port = self.table[networks[0]].nxt_port
-            addr = self.table[networks[0]].nxt_addr
+        if entry is not None:
+            port = entry.nxt_port
+            addr = entry.nxt_addr
             if addr == None: addr = ip_head.dst         #Local destination
             return port, addr
 
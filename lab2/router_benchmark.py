@@ -0,0 +1,127 @@
+'''
+Title:          router_benchmark
+Description:    Benchmarks the myrouter_part3 receive loop for different recv_batch sizes
+                and with or without the raw IPv4 fast path
+                Feeds Router.router_main a ready backlog of raw frames (mostly IPv4 to
+                resolved next hops, some ARP requests for the router) through a fake
+                network that parses on receive and serialises on send like the real one.
+                Reports packets/s for each batch size.
+Usage:          python3 router_benchmark.py [--batches 1,8,32,128] [--packets 100000]
+                                            [--routes 10000] [--stream uniform|zipf]
+                                            [--fast off|on|both]
+'''
+import os
+import time
+import random
+import argparse
+import tempfile
+
+from ipaddress import IPv4Address
+from switchyard.lib.userlib import *
+
+from fib_benchmark import INTERFACES, BenchNet, make_table, make_stream, write_table
+
+'''
+Class:          LoadNet
+Description:    Fake network with every frame already waiting to be received
+'''
+class LoadNet(BenchNet):
+    def __init__(self, frames):
+        super().__init__()
+        self.frames = frames
+        self.next   = 0
+        self.sent   = 0
+
+    def interface_by_macaddr(self, mac):
+        for intf in self.intfs:
+            if intf.ethaddr == mac: return intf
+        raise KeyError(mac)
+
+    def recv_packet(self, timeout=None):
+        if self.next == len(self.frames): raise Shutdown()
+        port, frame = self.frames[self.next]
+        self.next  += 1
+        return time.time(), port, Packet(raw=frame)
+
+    def send_packet(self, port, pkt):
+        pkt.to_bytes()
+        self.sent += 1
+
+'''
+make_frames
+Builds <count> raw frames arriving on router-eth0: IPv4 packets to <dsts> and,
+every <arp_every> frames, an ARP request for the router's address
+'''
+def make_frames(dsts, count, arp_every):
+    src_mac, router_mac, router_ip = "30:00:00:00:00:01", INTERFACES[0][1], INTERFACES[0][2]
+    arp = (Ethernet(src=src_mac, dst="ff:ff:ff:ff:ff:ff", ethertype=EtherType.ARP) +
+           Arp(operation=ArpOperation.Request, senderhwaddr=src_mac, senderprotoaddr="192.168.1.2",
+               targethwaddr="ff:ff:ff:ff:ff:ff", targetprotoaddr=router_ip)).to_bytes()
+
+    frames = []
+    for i in range(count):
+        if arp_every and i % arp_every == arp_every - 1:
+            frames.append(("router-eth0", arp))
+            continue
+        pkt = (Ethernet(src=src_mac, dst=router_mac, ethertype=EtherType.IPv4) +
+               IPv4(src="192.168.1.2", dst=IPv4Address(dsts[i % len(dsts)]), protocol=IPProtocol.ICMP, ttl=64) +
+               ICMP())
+        frames.append(("router-eth0", pkt.to_bytes()))
+
+    return frames
+
+'''
+run_case
+Runs the router over the frames with one batch size (and with or without the
+raw IPv4 fast path) and returns packets/s
+'''
+def run_case(router, frames, routes, batch, fast):
+    net = LoadNet(frames)
+    r   = router.Router(net, route_capacity = len(routes), recv_batch = batch, ipv4_fast_path = fast)
+
+    #Every next hop is already resolved, so packets are forwarded straight away
+    for _, _, hop, _ in routes:
+        r.other_proto_eth[IPv4Address(hop)] = EthAddr("40:00:00:00:00:01")
+
+    start = time.perf_counter()
+    r.router_main()
+    elapsed = time.perf_counter() - start
+    return len(frames) / elapsed, net.sent
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the Router receive loop")
+    parser.add_argument("--batches", default="1,8,32,128")
+    parser.add_argument("--packets", type=int, default=100000)
+    parser.add_argument("--routes",  type=int, default=10000)
+    parser.add_argument("--stream",  choices=("uniform", "zipf"), default="zipf")
+    parser.add_argument("--arp",     type=int, default=20, help="one ARP request every N frames (0 for none)")
+    parser.add_argument("--fast",    choices=("off", "on", "both"), default="off", help="raw IPv4 fast path")
+    parser.add_argument("--seed",    type=int, default=640)
+    args = parser.parse_args()
+
+    rng    = random.Random(args.seed)
+    routes = make_table(args.routes, rng)
+    dsts   = make_stream(routes, args.packets, args.stream, rng)
+    frames = make_frames(dsts, args.packets, args.arp)
+
+    #Router reads forwarding_table.txt from the working directory
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        write_table(routes, os.path.join(tmp, "forwarding_table.txt"))
+        os.chdir(tmp)
+        try:
+            import myrouter_part3 as router
+
+            modes = {"off": [False], "on": [True], "both": [False, True]}[args.fast]
+
+            print("{:>7} {:>5} {:>12} {:>9}".format("batch", "fast", "packets/s", "sent"))
+            print("-" * 36)
+            for batch in [int(x) for x in args.batches.split(",")]:
+                for fast in modes:
+                    rate, sent = run_case(router, frames, routes, batch, fast)
+                    print("{:>7} {:>5} {:>12,.0f} {:>9}".format(batch, "on" if fast else "off", rate, sent))
+        finally:
+            os.chdir(cwd)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+import struct
+
+from ipaddress import IPv4Address
+from switchyard.lib.userlib import *
+from switchyard.lib.packet import *
+
+def mk_pkt(hwsrc, hwdst, ipsrc, ipdst, reply=False, ttl = 64):
+    ether = Ethernet(src=hwsrc, dst=hwdst, ethertype=EtherType.IP)
+    ippkt = IPv4(src=ipsrc, dst=ipdst, protocol=IPProtocol.ICMP, ttl=ttl)
+    icmppkt = ICMP()
+    if reply:
+        icmppkt.icmptype = ICMPType.EchoReply
+    else:
+        icmppkt.icmptype = ICMPType.EchoRequest
+    return ether + ippkt + icmppkt
+
+
+def router_tests():
+    s = TestScenario("ARP give-up testing for the part 3 router")
+
+    # Initialize switch with 3 ports.
+    s.add_interface('router-eth0', '10:00:00:00:00:01', ipaddr = '192.168.1.1', netmask = '255.255.255.252')
+    s.add_interface('router-eth1', '10:00:00:00:00:02', ipaddr = '10.10.0.1', netmask = '255.255.0.0')
+    s.add_interface('router-eth2', '10:00:00:00:00:03', ipaddr = '172.16.42.1', netmask = '255.255.255.0')
+
+    # 1   IP packet to be forwarded to 172.16.42.2 should arrive on
+    #     router-eth0
+    packet = mk_pkt(hwsrc = '30:00:00:00:00:01', hwdst = '10:00:00:00:00:01', ipsrc = '192.168.1.100', ipdst = '172.16.42.2')
+    s.expect(PacketInputEvent("router-eth0", packet), "IP packet to be forwarded to 172.16.42.2 should arrive on router-eth0")
+
+    # 2 to 6
+    #     Router should send ARP request for 172.16.42.2 out router-eth2
+    #     3 times, 1 second apart
+    arp_request = create_ip_arp_request('10:00:00:00:00:03', '172.16.42.1', '172.16.42.2')
+    s.expect(PacketOutputEvent("router-eth2", arp_request), "Router should send ARP request for 172.16.42.2 out router-eth2 interface")
+
+    s.expect(PacketInputTimeoutEvent(1.0), "Waiting 1.0 seconds")
+    s.expect(PacketOutputEvent("router-eth2", arp_request), "Router should send 2nd ARP request for 172.16.42.2 out router-eth2 interface")
+
+    s.expect(PacketInputTimeoutEvent(1.0), "Waiting 1.0 seconds")
+    s.expect(PacketOutputEvent("router-eth2", arp_request), "Router should send 3rd ARP request for 172.16.42.2 out router-eth2 interface")
+
+    # 7   Router gives up 1 second after the 3rd request and drops the packet,
+    #     without a 4th request
+    s.expect(PacketInputTimeoutEvent(1.5), "Router should give up on 172.16.42.2 and drop the packet")
+
+    # 8 to 11
+    #     A new packet for 172.16.42.2 starts a new ARP request; once the
+    #     reply arrives only the new packet is forwarded
+    packet = mk_pkt(hwsrc = '30:00:00:00:00:01', hwdst = '10:00:00:00:00:01', ipsrc = '192.168.1.101', ipdst = '172.16.42.2')
+    s.expect(PacketInputEvent("router-eth0", packet), "New IP packet to 172.16.42.2 should arrive on router-eth0")
+
+    s.expect(PacketOutputEvent("router-eth2", arp_request), "Router should send a new ARP request for 172.16.42.2 out router-eth2 interface")
+
+    arp_response = create_ip_arp_reply('30:00:00:00:00:03', '10:00:00:00:00:03', '172.16.42.2', '172.16.42.1')
+    s.expect(PacketInputEvent("router-eth2", arp_response), "Router should receive ARP response for 172.16.42.2 on router-eth2 interface")
+
+    packet = mk_pkt(hwsrc = '10:00:00:00:00:03', hwdst = '30:00:00:00:00:03', ipsrc = '192.168.1.101', ipdst = '172.16.42.2', ttl = 63)
+    s.expect(PacketOutputEvent("router-eth2", packet), "Only the new IP packet should be forwarded to 172.16.42.2 out router-eth2")
+
+    return s
+
+scenario = router_tests()
@@ -0,0 +1,81 @@
+import struct
+
+from ipaddress import IPv4Address
+from switchyard.lib.userlib import *
+from switchyard.lib.packet import *
+
+# Tests the negative ARP cache. Run with a hold-down (and an unbounded ARP cache):
+#     swyard -t stage3_holddown_tests.py myrouter_part3.py -g "arp_holddown=30 arp_capacity=None"
+
+def mk_pkt(hwsrc, hwdst, ipsrc, ipdst, reply=False, ttl = 64):
+    ether = Ethernet(src=hwsrc, dst=hwdst, ethertype=EtherType.IP)
+    ippkt = IPv4(src=ipsrc, dst=ipdst, protocol=IPProtocol.ICMP, ttl=ttl)
+    icmppkt = ICMP()
+    if reply:
+        icmppkt.icmptype = ICMPType.EchoReply
+    else:
+        icmppkt.icmptype = ICMPType.EchoRequest
+    return ether + ippkt + icmppkt
+
+
+def router_tests():
+    s = TestScenario("ARP hold-down testing for the part 3 router")
+
+    # Initialize switch with 3 ports.
+    s.add_interface('router-eth0', '10:00:00:00:00:01', ipaddr = '192.168.1.1', netmask = '255.255.255.252')
+    s.add_interface('router-eth1', '10:00:00:00:00:02', ipaddr = '10.10.0.1', netmask = '255.255.0.0')
+    s.add_interface('router-eth2', '10:00:00:00:00:03', ipaddr = '172.16.42.1', netmask = '255.255.255.0')
+
+    # 1 to 7
+    #     Router sends 3 ARP requests for 172.16.42.2, 1 second apart, then
+    #     gives up and puts 172.16.42.2 in hold-down
+    packet = mk_pkt(hwsrc = '30:00:00:00:00:01', hwdst = '10:00:00:00:00:01', ipsrc = '192.168.1.100', ipdst = '172.16.42.2')
+    s.expect(PacketInputEvent("router-eth0", packet), "IP packet to be forwarded to 172.16.42.2 should arrive on router-eth0")
+
+    arp_request = create_ip_arp_request('10:00:00:00:00:03', '172.16.42.1', '172.16.42.2')
+    s.expect(PacketOutputEvent("router-eth2", arp_request), "Router should send ARP request for 172.16.42.2 out router-eth2 interface")
+
+    s.expect(PacketInputTimeoutEvent(1.0), "Waiting 1.0 seconds")
+    s.expect(PacketOutputEvent("router-eth2", arp_request), "Router should send 2nd ARP request for 172.16.42.2 out router-eth2 interface")
+
+    s.expect(PacketInputTimeoutEvent(1.0), "Waiting 1.0 seconds")
+    s.expect(PacketOutputEvent("router-eth2", arp_request), "Router should send 3rd ARP request for 172.16.42.2 out router-eth2 interface")
+
+    s.expect(PacketInputTimeoutEvent(1.5), "Router should give up on 172.16.42.2 and drop the packet")
+
+    # 8 to 9
+    #     During the hold-down a new packet for 172.16.42.2 is dropped at
+    #     once, without a new ARP request
+    packet = mk_pkt(hwsrc = '30:00:00:00:00:01', hwdst = '10:00:00:00:00:01', ipsrc = '192.168.1.101', ipdst = '172.16.42.2')
+    s.expect(PacketInputEvent("router-eth0", packet), "IP packet to 172.16.42.2 in hold-down should arrive on router-eth0")
+    s.expect(PacketInputTimeoutEvent(1.0), "Router should drop the packet without sending an ARP request")
+
+    # 10 to 12
+    #     The hold-down is per next hop: 172.16.42.3 is still resolved
+    packet = mk_pkt(hwsrc = '30:00:00:00:00:01', hwdst = '10:00:00:00:00:01', ipsrc = '192.168.1.102', ipdst = '172.16.42.3')
+    s.expect(PacketInputEvent("router-eth0", packet), "IP packet to 172.16.42.3 should arrive on router-eth0")
+
+    arp_request3 = create_ip_arp_request('10:00:00:00:00:03', '172.16.42.1', '172.16.42.3')
+    s.expect(PacketOutputEvent("router-eth2", arp_request3), "Router should send ARP request for 172.16.42.3 out router-eth2 interface")
+
+    arp_response = create_ip_arp_reply('30:00:00:00:00:04', '10:00:00:00:00:03', '172.16.42.3', '172.16.42.1')
+    s.expect(PacketInputEvent("router-eth2", arp_response), "Router should receive ARP response for 172.16.42.3 on router-eth2 interface")
+
+    packet = mk_pkt(hwsrc = '10:00:00:00:00:03', hwdst = '30:00:00:00:00:04', ipsrc = '192.168.1.102', ipdst = '172.16.42.3', ttl = 63)
+    s.expect(PacketOutputEvent("router-eth2", packet), "IP packet should be forwarded to 172.16.42.3 out router-eth2")
+
+    # 13 to 15
+    #     An ARP reply from 172.16.42.2 lifts its hold-down early, so the next
+    #     packet is forwarded straight away
+    arp_response = create_ip_arp_reply('30:00:00:00:00:03', '10:00:00:00:00:03', '172.16.42.2', '172.16.42.1')
+    s.expect(PacketInputEvent("router-eth2", arp_response), "Router should receive ARP response for 172.16.42.2 on router-eth2 interface")
+
+    packet = mk_pkt(hwsrc = '30:00:00:00:00:01', hwdst = '10:00:00:00:00:01', ipsrc = '192.168.1.103', ipdst = '172.16.42.2')
+    s.expect(PacketInputEvent("router-eth0", packet), "IP packet to 172.16.42.2 should arrive on router-eth0")
+
+    packet = mk_pkt(hwsrc = '10:00:00:00:00:03', hwdst = '30:00:00:00:00:03', ipsrc = '192.168.1.103', ipdst = '172.16.42.2', ttl = 63)
+    s.expect(PacketOutputEvent("router-eth2", packet), "IP packet should be forwarded to 172.16.42.2 out router-eth2")
+
+    return s
+
+scenario = router_tests()
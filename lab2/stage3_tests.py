@@ -89,8 +89,51 @@ def router_tests():
     # After this if another packet is received with its prefix in the same network as both static and dynamic routes,
     # the dynamic one gets chosen.
 
-    # TODO for students: Write your own test for the above mentioned comment. This is not a deliverable. But will help
-    #  you test if your code is correct or not.
+    # 10  Dynamic route 172.16.64.0/20 via 192.168.1.2, inside the static
+    #     route 172.16.64.0/18 via 10.10.1.254. The table now holds 5
+    #     non-local routes, so the oldest one (static 172.16.0.0/16) is
+    #     evicted
+    drm_pkt = mk_dynamic_routing_packet('10:00:00:00:00:01',
+                                        IPv4Address('172.16.64.0'),
+                                        IPv4Address('255.255.240.0'),
+                                        IPv4Address('192.168.1.2'))
+    s.expect(PacketInputEvent("router-eth0", drm_pkt),
+             "Dynamic routing message for 172.16.64.0/20 on eth0")
+
+    # 11  IP packet to 172.16.65.1 matches both routes; the longer dynamic
+    #     prefix wins, so the router ARPs for 192.168.1.2 out router-eth0
+    packet = mk_pkt(hwsrc='20:00:00:00:00:01', hwdst='10:00:00:00:00:02', ipsrc='10.10.5.5', ipdst='172.16.65.1')
+    s.expect(PacketInputEvent("router-eth1", packet), "IP packet to 172.16.65.1 should arrive on router-eth1")
+
+    arp_request = create_ip_arp_request('10:00:00:00:00:01', '192.168.1.1', '192.168.1.2')
+    s.expect(PacketOutputEvent("router-eth0", arp_request), "Router should send ARP request for 192.168.1.2 (dynamic route) out router-eth0")
+
+    arp_response = create_ip_arp_reply('30:00:00:00:00:02', '10:00:00:00:00:01', '192.168.1.2', '192.168.1.1')
+    s.expect(PacketInputEvent("router-eth0", arp_response), "Router should receive ARP response for 192.168.1.2 on router-eth0")
+
+    packet = mk_pkt(hwsrc='10:00:00:00:00:01', hwdst='30:00:00:00:00:02', ipsrc='10.10.5.5', ipdst='172.16.65.1', ttl=63)
+    s.expect(PacketOutputEvent("router-eth0", packet), "IP packet to 172.16.65.1 should be forwarded out router-eth0 (dynamic route)")
+
+    # 12  IP packet to 172.16.80.1 is outside the dynamic /20, so the static
+    #     /18 via 10.10.1.254 out router-eth1 is still used
+    packet = mk_pkt(hwsrc='30:00:00:00:00:02', hwdst='10:00:00:00:00:01', ipsrc='192.168.1.2', ipdst='172.16.80.1')
+    s.expect(PacketInputEvent("router-eth0", packet), "IP packet to 172.16.80.1 should arrive on router-eth0")
+
+    arp_request = create_ip_arp_request('10:00:00:00:00:02', '10.10.0.1', '10.10.1.254')
+    s.expect(PacketOutputEvent("router-eth1", arp_request), "Router should send ARP request for 10.10.1.254 (static route) out router-eth1")
+
+    arp_response = create_ip_arp_reply('20:00:00:00:01:fe', '10:00:00:00:00:02', '10.10.1.254', '10.10.0.1')
+    s.expect(PacketInputEvent("router-eth1", arp_response), "Router should receive ARP response for 10.10.1.254 on router-eth1")
+
+    packet = mk_pkt(hwsrc='10:00:00:00:00:02', hwdst='20:00:00:00:01:fe', ipsrc='192.168.1.2', ipdst='172.16.80.1', ttl=63)
+    s.expect(PacketOutputEvent("router-eth1", packet), "IP packet to 172.16.80.1 should be forwarded out router-eth1 (static route)")
+
+    # 13  IP packet to 172.16.1.1 was only covered by the evicted
+    #     172.16.0.0/16 route (via 192.168.1.2, already resolved), so it is
+    #     dropped instead of forwarded out router-eth0
+    packet = mk_pkt(hwsrc='20:00:00:00:00:01', hwdst='10:00:00:00:00:02', ipsrc='10.10.5.5', ipdst='172.16.1.1')
+    s.expect(PacketInputEvent("router-eth1", packet), "IP packet to 172.16.1.1 (evicted route) should arrive on router-eth1")
+    s.expect(PacketInputTimeoutEvent(1.0), "Router should drop the packet to 172.16.1.1")
 
     return s
 
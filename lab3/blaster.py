@@ -10,6 +10,10 @@ from switchyard.lib.userlib import *
 import time
 import sys
 
+import tracing
+
+TRACE = tracing.get_tracer("blaster")
+
 ENDIAN='big'
 
 class WindowEntry:
@@ -122,7 +126,8 @@ class Blaster:
                 return
             self.send(self.rhs)
             self.window[self.rhs%self.window_size] = WindowEntry(self.rhs)
-            log_debug("blasted pkt with seq # of {}".format(self.rhs))
+            TRACE.next_packet()
+            TRACE.trace("blasted pkt with seq # of {}", self.rhs)
             self.rhs += 1
 
     def available_window_count(self):
@@ -167,7 +172,7 @@ class Blaster:
         if seq_num < self.lhs or seq_num >= self.rhs:
             log_debug('Ignored out-of-bound ACK')
             return
-        log_debug('Received ACK for seq # {}'.format(seq_num))
+        TRACE.trace('Received ACK for seq # {}', seq_num)
         self.window[seq_num%self.window_size].ack = True
         self.metrics_last_ack_time = now
         rtt_ms = (now - self.window[seq_num%self.window_size].ts_initial) * 1000
@@ -207,6 +212,7 @@ class Blaster:
                 log_debug("Got shutdown signal")
                 break
 
+            TRACE.next_packet()
             self.process_ack(pkt)
             self.advance_lhs()
 
@@ -225,6 +231,7 @@ class Blaster:
 
 def main(net):
     b = Blaster(net,"./blaster_params.txt")
-    log_debug(b)
+    TRACE.refresh()
+    TRACE.debug("{}", b)
     b.start()
     net.shutdown()
@@ -12,12 +12,16 @@ import random
 import time
 import sys
 
+import tracing
+
+TRACE = tracing.get_tracer("middlebox")
+
 def drop(percent):
     return random.randrange(100) < percent
 
 def delay(mean, std):
     delay =random.gauss(mean, std)
-    print(delay)
+    TRACE.trace("Delay: {}", delay)
     if delay > 0:
         time.sleep(delay/1000)
 
@@ -58,7 +62,8 @@ def load_file(filename):
 
 '''
 update_pkt
-Replaces the Ethernet header when forwarding.
+Rewrites the Ethernet header in place when forwarding (a new header is only
+built if the frame is not plain Ethernet + IPv4).
 Updates ttl on the IPv4 header
 Parameters:
     pkt         - packet to update
@@ -66,9 +71,14 @@ Parameters:
     out_dst     - dest mac (EthAddr)
 '''
 def update_pkt(pkt, out_port, out_dst):
-    del pkt[0]
-    eth_head = Ethernet(src=out_port, dst=out_dst, ethertype=EtherType.IPv4)
-    pkt.prepend_header(eth_head)
+    eth_head = pkt[0]
+    if isinstance(eth_head, Ethernet) and eth_head.ethertype == EtherType.IPv4:
+        eth_head.src = out_port
+        eth_head.dst = out_dst
+    else:
+        del pkt[0]
+        eth_head = Ethernet(src=out_port, dst=out_dst, ethertype=EtherType.IPv4)
+        pkt.prepend_header(eth_head)
     pkt[IPv4].ttl -= 1
 
 
@@ -89,13 +99,21 @@ def switchy_main(net):
 
     config = load_file("./middlebox_params.txt")
 
+    # Interfaces and next hop MACs, resolved once instead of per packet
+    blastee_intf = net.interface_by_name("middlebox-eth1")
+    blaster_intf = net.interface_by_name("middlebox-eth0")
+    blastee_mac = EthAddr('20:00:00:00:00:01')
+    blaster_mac = EthAddr('10:00:00:00:00:01')
+
     random_seed = config['s']
     random.seed(random_seed) #Extract random seed from params file
+    TRACE.refresh()
 
     while True:
         try:
             _,dev,pkt = net.recv_packet()
-            log_debug("Device is {}".format(dev))
+            TRACE.next_packet()
+            TRACE.trace("Device is {}", dev)
         except NoPackets:
             log_debug("No packets available in recv_packet")
             continue
@@ -103,18 +121,18 @@ def switchy_main(net):
             log_debug("Got shutdown signal")
             break
 
-        log_debug("I got a packet {}".format(pkt))
+        TRACE.trace("I got a packet {}", pkt)
 
         if not pkt.has_header(IPv4):
-            log_debug("Dropping non IPv4 packet {}".format(pkt))
+            TRACE.trace("Dropping non IPv4 packet {}", pkt)
             continue
 
         if ttl_reached(pkt):
-            log_debug("Dropping packet as ttl has been reached {}".format(pkt))
+            TRACE.trace("Dropping packet as ttl has been reached {}", pkt)
             continue
 
         if dev == "middlebox-eth0":
-            log_debug("Received from blaster: {}".format(pkt))
+            TRACE.trace("Received from blaster: {}", pkt)
             '''
             Received data packet
             Should I drop it?
@@ -122,25 +140,23 @@ def switchy_main(net):
             If not, modify headers, add a delay & send to blastee
             '''
             if drop(config['p']):
-                log_debug("Dropping packet: {}".format(pkt))
+                TRACE.trace("Dropping packet: {}", pkt)
             else:
                 delay(config['dm'], config['dstd'])
-                out_intf = net.interface_by_name("middlebox-eth1")
-                update_pkt(pkt, out_intf.ethaddr, '20:00:00:00:00:01')
-                log_debug("Sending packet: {}".format(pkt))
+                update_pkt(pkt, blastee_intf.ethaddr, blastee_mac)
+                TRACE.trace("Sending packet: {}", pkt)
                 net.send_packet("middlebox-eth1", pkt)
 
         elif dev == "middlebox-eth1":
-            log_debug("Received from blastee: {}".format(pkt))
+            TRACE.trace("Received from blastee: {}", pkt)
             '''
             Received ACK
             Modify headers & send to blaster. Not dropping ACK packets!
             Don't add any delay as well
             net.send_packet("middlebox-eth0", pkt)
             '''
-            out_intf = net.interface_by_name("middlebox-eth0")
-            update_pkt(pkt, out_intf.ethaddr, '10:00:00:00:00:01')
-            log_debug("Sending packet: {}".format(pkt))
+            update_pkt(pkt, blaster_intf.ethaddr, blaster_mac)
+            TRACE.trace("Sending packet: {}", pkt)
             net.send_packet("middlebox-eth0", pkt)
         else:
             log_debug("Oops :))")
@@ -13,8 +13,9 @@
 
 target="/tmp/.tar.gz"
 
-tar -czvf "${target}" \
+tar -czhvf "${target}" \
     blastee.py   \
     blaster.py   \
     middlebox.py \
+    tracing.py   \
     README.txt
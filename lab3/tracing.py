@@ -0,0 +1 @@
+../common/tracing.py
\ No newline at end of file